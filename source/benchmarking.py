@@ -6,9 +6,8 @@ import time
 
 import numpy as np
 
-from dfa import DFA, random_dfa, dfa_intersection, save_dfa_as_part_of_model, load_dfa_dot
+from dfa import DFA, random_dfa, dfa_intersection, save_dfa_as_part_of_model, load_dfa, dfa_distance
 from dfa_check import DFAChecker
-from exact_teacher import ExactTeacher
 from learner_decison_tree import DecisionTreeLearner
 from lstar.Extraction import extract as extract_iclm
 from lstar.Tomita_Grammars import tomita_1, tomita_2, tomita_3, tomita_4, tomita_5, tomita_6, tomita_7
@@ -18,7 +17,7 @@ from specifications_for_models import Lang, tomita_1_check_languages, tomita_2_c
     tomita_7_check_languages
 from pac_teacher import PACTeacher
 from pac_teacher_wordmax import PACTeacherMeme
-from random_words import confidence_interval_many, random_word, confidence_interval_subset, model_check_random
+from random_words import confidence_interval_many_streaming, random_word, confidence_interval_subset, model_check_random
 from functools import partial
 
 FIELD_NAMES = ["alph_len",
@@ -58,13 +57,6 @@ def write_line_csv(filename, benchmark, fieldnames=None):
         writer.writerow(benchmark)
 
 
-def minimize_dfa(dfa: DFA) -> DFA:
-    teacher_pac = ExactTeacher(dfa)
-    student = DecisionTreeLearner(teacher_pac)
-    teacher_pac.teach(student)
-    return student.dfa
-
-
 #
 def learn_dfa(dfa: DFA, benchmark, hidden_dim=-1, num_layers=-1, embedding_dim=-1, batch_size=-1,
               epoch=-1, num_of_exm_per_length=-1, word_training_length=-1):
@@ -175,7 +167,7 @@ def check_rnn_acc_to_spec(rnn, spec, benchmark, timeout=900):
     counter = teacher_pac.check_and_teach(student, spec[0], timeout=timeout)
     benchmark.update({"during_time_spec": "{:.3}".format(time.time() - start_time)})
     dfa_extract_w_spec = student.dfa
-    dfa_extract_w_spec = minimize_dfa(dfa_extract_w_spec)
+    dfa_extract_w_spec = dfa_extract_w_spec.minimize()
 
     if counter is None:
         print("No mistakes found ==> DFA learned:")
@@ -209,7 +201,7 @@ def check_rnn_acc_to_spec(rnn, spec, benchmark, timeout=900):
 
     benchmark.update({"mistake_time_extraction": "{:.3}".format(time.time() - start_time)})
 
-    dfa_extract = minimize_dfa(student.dfa)
+    dfa_extract = student.dfa.minimize()
     if counter is None:
         print("No mistakes found ==> DFA learned:")
         print(student.dfa)
@@ -242,7 +234,7 @@ def check_rnn_acc_to_spec(rnn, spec, benchmark, timeout=900):
     #
     # benchmark.update({"mistake_time_super": "{:.3}".format(time.time() - start_time)})
     #
-    # dfa_extract_super = minimize_dfa(student.dfa)
+    # dfa_extract_super = student.dfa.minimize()
     # if counter is None:
     #     print("No mistakes found ==> DFA learned:")
     #     print(student.dfa)
@@ -292,7 +284,7 @@ def check_rnn_acc_to_spec_only_mc(rnn, spec, benchmark, timeout=900):
     counter = teacher_pac.check_and_teach(student, spec[0], timeout=timeout)
     benchmark.update({"during_time_spec": "{:.3}".format(time.time() - start_time)})
     dfa_extract_w_spec = student.dfa
-    dfa_extract_w_spec = minimize_dfa(dfa_extract_w_spec)
+    dfa_extract_w_spec = dfa_extract_w_spec.minimize()
 
     if counter is None:
         print("No mistakes found ==> DFA learned:")
@@ -320,7 +312,7 @@ def check_rnn_acc_to_spec_only_mc(rnn, spec, benchmark, timeout=900):
     # counter = teacher_pac.check_and_teach(student, spec[0])
     # benchmark.update({"during_time_spec": "{:.3}".format(time.time() - start_time)})
     # dfa_extract_w_spec = student.dfa
-    # dfa_extract_w_spec = minimize_dfa(dfa_extract_w_spec)
+    # dfa_extract_w_spec = dfa_extract_w_spec.minimize()
     #
     # if counter is None:
     #     print("No mistakes found ==> DFA learned:")
@@ -357,7 +349,7 @@ def check_rnn_acc_to_spec_only_mc(rnn, spec, benchmark, timeout=900):
 
 
 
-def extract_dfa_from_rnn(rnn, benchmark, timeout=900):
+def extract_dfa_from_rnn(rnn, benchmark, timeout=900, learner=DecisionTreeLearner):
     rnn.num_of_membership_queries = 0
     teacher_pac = PACTeacher(rnn)
 
@@ -366,11 +358,11 @@ def extract_dfa_from_rnn(rnn, benchmark, timeout=900):
     ###################################################
     print("Starting DFA extraction w/o model checking")
     start_time = time.time()
-    student = DecisionTreeLearner(teacher_pac)
+    student = learner(teacher_pac)
     teacher_pac.teach(student, timeout=timeout)
     benchmark.update({"extraction_time": "{:.3}".format(time.time() - start_time)})
 
-    dfa_extract = minimize_dfa(student.dfa)
+    dfa_extract = student.dfa.minimize()
     print(student.dfa)
     benchmark.update({"dfa_extract_states": len(dfa_extract.states),
                       "dfa_extract_final": len(dfa_extract.final_states),
@@ -395,7 +387,7 @@ def extract_dfa_from_rnn(rnn, benchmark, timeout=900):
 
 def compute_distances(models, dfa_spec, benchmark, epsilon=0.005, delta=0.001):
     print("Starting distance measuring")
-    output, samples = confidence_interval_many(models, random_word, width=epsilon, confidence=delta)
+    output = confidence_interval_many_streaming(models, width=epsilon, confidence=delta)
     print("The confidence interval for epsilon = {} , delta = {}".format(delta, epsilon))
     print(output)
 
@@ -422,14 +414,22 @@ def compute_distances(models, dfa_spec, benchmark, epsilon=0.005, delta=0.001):
 
 
 def compute_distances_no_model_checking(models, benchmark, epsilon=0.005, delta=0.001):
+    """
+    models - the target (a DFA or a Lang), the RNN and the extracted DFA. The distances from the RNN are estimated by
+    sampling, the distance between the target and the extracted DFA is computed exactly by dfa_distance when the
+    target is a DFA, and sampled with the others otherwise.
+    """
     print("Starting distance measuring")
-    output, samples = confidence_interval_many(models, random_word, width=epsilon, confidence=delta)
+    exact = isinstance(models[0], DFA) and isinstance(models[2], DFA)
+    pairs = [(0, 1), (1, 2)] if exact else None
+    output = confidence_interval_many_streaming(models, width=epsilon, confidence=delta, pairs=pairs)
     print("The confidence interval for epsilon = {} , delta = {}".format(delta, epsilon))
     print(output)
 
+    dist_target_vs_extr = dfa_distance(models[0], models[2]) if exact else output[0][2]
     benchmark.update({"dist_rnn_vs_target": "{}".format(output[1][0]),
                       "dist_rnn_vs_extr": "{}".format(output[1][2]),
-                      "dist_target_vs_extr": "{}".format(output[0][2])})
+                      "dist_target_vs_extr": "{}".format(dist_target_vs_extr)})
 
     print("Finished distance measuring")
 
@@ -447,8 +447,8 @@ def rand_benchmark(save_dir=None):
         dfa_rand1 = random_dfa(alphabet, min_states=10, max_states=15, min_final=2, max_final=10)
         dfa_rand2 = random_dfa(alphabet, min_states=5, max_states=7, min_final=4, max_final=5)
 
-        dfa_inter = minimize_dfa(dfa_intersection(dfa_rand1, dfa_rand2))
-        dfa_spec = minimize_dfa(dfa_rand2)
+        dfa_inter = dfa_intersection(dfa_rand1, dfa_rand2).minimize()
+        dfa_spec = dfa_rand2.minimize()
 
     benchmark.update({"dfa_inter_states": len(dfa_inter.states), "dfa_inter_final": len(dfa_inter.final_states),
                       "dfa_spec_states": len(dfa_spec.states), "dfa_spec_final": len(dfa_spec.final_states)})
@@ -713,10 +713,11 @@ def check_folder_of_rand(folder):
         if os.path.isfile(folder[0] + "/meta"):
             name = folder[0].split('/')[-1]
             rnn = RNNLanguageClasifier().load_lstm(folder[0])
-            dfa = load_dfa_dot(folder[0] + "/dfa.dot")
+            dfa = load_dfa(folder[0] + "/dfa")
             i = 1
             for dfa_spec in from_dfa_to_sup_dfa_gen(dfa):
                 dfa_spec.save(folder[0] + "/spec_second_" + str(i))
+                dfa_spec.save_npz(folder[0] + "/spec_second_" + str(i))
                 benchmark = {"name": name, "spec_num": str(i),
                              "spec_states":len(dfa_spec.states),
                              "spec_fin":len(dfa_spec.final_states)}
@@ -746,17 +747,17 @@ def from_dfa_to_sup_dfa_gen(dfa: DFA, tries=5):
     if len(not_final_states) == 1:
         return
 
-    created_dfas = []
+    created_dfas = set()
     for _ in range(tries):
         s = np.random.randint(1, len(not_final_states))
         new_final_num = np.random.choice(len(not_final_states), size=s, replace=False)
         new_final = [not_final_states[i] for i in new_final_num]
         dfa_spec = DFA(dfa.init_state, dfa.final_states + new_final, dfa.transitions)
-        dfa_spec = minimize_dfa(dfa_spec)
+        dfa_spec = dfa_spec.minimize()
 
         if dfa_spec in created_dfas:
             continue
-        created_dfas.append(dfa_spec)
+        created_dfas.add(dfa_spec)
         yield dfa_spec
 
 
@@ -768,11 +769,17 @@ def complition(folder):
         if os.path.isfile(folder[0] + "/meta"):
             name = folder[0].split('/')[-1]
             rnn = RNNLanguageClasifier().load_lstm(folder[0])
+            # the same language can be saved under several spec files, it is checked only once per rnn
+            checked_specs = {}
             # dfa = load_dfa_dot(folder[0] + "/dfa.dot")
             for file in os.listdir(folder[0]):
-                if 'spec_second_' in file:
-                    dfa_spec = load_dfa_dot(folder[0]+"/"+file)
+                if 'spec_second_' in file and file.endswith(".dot"):
+                    dfa_spec = load_dfa(folder[0]+"/"+file)
                     benchmark = {"name": name, "spec_num": file}
+                    if dfa_spec in checked_specs:
+                        benchmark.update(checked_specs[dfa_spec])
+                        write_line_csv(summary_csv, benchmark, benchmark.keys())
+                        continue
                     dfa_extracted, counter = check_rnn_acc_to_spec_only_mc(rnn, [DFAChecker(dfa_spec)], benchmark, timeout)
                     if counter is not None:
                         flawed_flows = []
@@ -781,6 +788,7 @@ def complition(folder):
                         flawed_flow_cross_product(counter, dfa_extracted, dfa_spec,flawed_flows, rnn )
 
                         benchmark.update({"flawed_flows": flawed_flows})
+                    checked_specs[dfa_spec] = {key: benchmark[key] for key in benchmark if key != "spec_num"}
                     if first_entry:
                         write_csv_header(summary_csv, benchmark.keys())
                         first_entry = False
@@ -795,11 +803,16 @@ def complition_smc(folder):
         if os.path.isfile(folder[0] + "/meta"):
             name = folder[0].split('/')[-1]
             rnn = RNNLanguageClasifier().load_lstm(folder[0])
+            checked_specs = {}
             # dfa = load_dfa_dot(folder[0] + "/dfa.dot")
             for file in os.listdir(folder[0]):
-                if 'spec_second_' in file:
-                    dfa_spec = load_dfa_dot(folder[0]+"/"+file)
+                if 'spec_second_' in file and file.endswith(".dot"):
+                    dfa_spec = load_dfa(folder[0]+"/"+file)
                     benchmark = {"name": name, "spec_num": file}
+                    if dfa_spec in checked_specs:
+                        benchmark.update(checked_specs[dfa_spec])
+                        write_line_csv(summary_csv, benchmark, benchmark.keys())
+                        continue
                     print("starting rand model checking")
                     rnn.num_of_membership_queries = 0
                     start_time = time.time()
@@ -809,6 +822,7 @@ def complition_smc(folder):
                     benchmark.update({"mistake_time_rand": "{:.3}".format(time.time() - start_time),
                                       "mistake_rand": counter,
                                       "rand_num_queries": rnn.num_of_membership_queries})
+                    checked_specs[dfa_spec] = {key: benchmark[key] for key in benchmark if key != "spec_num"}
 
                     print(benchmark)
 
@@ -5,14 +5,13 @@ import time
 
 import numpy as np
 
-from dfa import DFA, random_dfa, dfa_intersection, save_dfa_as_part_of_model,load_dfa_dot
+from dfa import DFA, random_dfa, dfa_intersection, save_dfa_as_part_of_model, load_dfa, dfa_distance
 from dfa_check import DFAChecker
-from exact_teacher import ExactTeacher
 from learner_decison_tree import DecisionTreeLearner
 from lstar.Extraction import extract as extract_iclm
 from modelPadding import RNNLanguageClasifier
 from pac_teacher import PACTeacher
-from random_words import confidence_interval_many, random_word, confidence_interval_subset,confidence_interval_many_cython
+from random_words import confidence_interval_many_streaming, random_word, confidence_interval_subset
 
 FIELD_NAMES = ["alph_len",
 
@@ -45,13 +44,6 @@ def write_line_csv(filename, benchmark, fieldnames=None):
         writer = csv.DictWriter(benchmark_summary, fieldnames=fieldnames)
         writer.writerow(benchmark)
 
-def minimize_dfa(dfa: DFA) -> DFA:
-    teacher_pac = ExactTeacher(dfa)
-    student = DecisionTreeLearner(teacher_pac)
-    teacher_pac.teach(student)
-    return student.dfa
-
-
 def learn_dfa(dfa: DFA, benchmark, hidden_dim=-1, num_layers=-1, embedding_dim=-1, batch_size=-1,
               epoch=-1,num_of_examples=-1):
     if hidden_dim == -1:
@@ -111,7 +103,7 @@ def learn_and_check(dfa: DFA, benchmark, dir_name=None):
     compute_distances_no_model_checking(models, benchmark, epsilon=0.0002, delta=0.005)
 
 
-def extract_dfa_from_rnn(rnn, benchmark, timeout=300):
+def extract_dfa_from_rnn(rnn, benchmark, timeout=300, learner=DecisionTreeLearner):
     teacher_pac = PACTeacher(rnn)
 
     ###################################################
@@ -119,13 +111,13 @@ def extract_dfa_from_rnn(rnn, benchmark, timeout=300):
     ###################################################
     print("Starting DFA extraction w/o model checking")
     start_time = time.time()
-    student = DecisionTreeLearner(teacher_pac)
+    student = learner(teacher_pac)
     teacher_pac.is_counter_example_in_batches = True
     teacher_pac.teach(student, timeout=timeout)
     benchmark.update({"extraction_time": "{:.3}".format(time.time() - start_time),
                       "Timeout":timeout})
 
-    dfa_extract = minimize_dfa(student.dfa)
+    dfa_extract = student.dfa.minimize()
     print(student.dfa)
     benchmark.update({"dfa_extract_states": len(dfa_extract.states),
                       "dfa_extract_final": len(dfa_extract.final_states)})
@@ -148,20 +140,32 @@ def extract_dfa_from_rnn(rnn, benchmark, timeout=300):
     return [(dfa_extract, "dfa_extract")]
 
 def compute_distances_no_model_checking(models, benchmark, epsilon=0.005, delta=0.001):
+    """
+    models - the target (a DFA or a Lang), the RNN and the extracted DFA. The distances from the RNN are estimated by
+    sampling, the distance between the target and the extracted DFA is computed exactly by dfa_distance when the
+    target is a DFA, and sampled with the others otherwise.
+    """
     print("Starting distance measuring")
-    output, samples = confidence_interval_many_cython(models, width=epsilon, confidence=delta)
+    exact = isinstance(models[0], DFA) and isinstance(models[2], DFA)
+    pairs = [(0, 1), (1, 2)] if exact else None
+    output = confidence_interval_many_streaming(models, width=epsilon, confidence=delta, pairs=pairs)
     print("The confidence interval for epsilon = {} , delta = {}".format(delta, epsilon))
     print(output)
 
+    dist_target_vs_extr = dfa_distance(models[0], models[2]) if exact else output[0][2]
     benchmark.update({"dist_rnn_vs_inter": "{}".format(output[1][0]),
-                      "dist_rnn_vs_extr": "{}".format(output[1][2])})
-
-    benchmark.update({"dist_inter_vs_extr": "{}".format(output[0][2])})
+                      "dist_rnn_vs_extr": "{}".format(output[1][2]),
+                      "dist_inter_vs_extr": "{}".format(dist_target_vs_extr)})
 
     print("Finished distance measuring")
 
 
-def rand_benchmark(save_dir=None):
+def rand_benchmark(save_dir=None, seen_dfas=None):
+    """
+    seen_dfas - targets that were already benchmarked, a target that recurs is drawn again.
+    """
+    if seen_dfas is None:
+        seen_dfas = set()
     dfa = DFA(0, {0}, {0: {0: 0}})
 
     full_alphabet = "abcdefghijklmnopqrstuvwxyz"
@@ -170,12 +174,13 @@ def rand_benchmark(save_dir=None):
     benchmark = {}
     benchmark.update({"alph_len": len(alphabet)})
 
-    while len(dfa.states) < 5:
+    while len(dfa.states) < 5 or dfa in seen_dfas:
         max_final_states = np.random.randint(5, 29)
         dfa_rand1 = random_dfa(alphabet, min_states=max_final_states, max_states=30, min_final=1,
                                max_final=max_final_states)
-        dfa = minimize_dfa(dfa_rand1)
+        dfa = dfa_rand1.minimize()
 
+    seen_dfas.add(dfa)
     benchmark.update({"dfa_states": len(dfa.states), "dfa_final": len(dfa.final_states)})
 
 
@@ -193,9 +198,10 @@ def run_rand_benchmarks_wo_model_checking(num_of_bench=30, save_dir=None):
         os.makedirs(save_dir)
 
     first = True
+    seen_dfas = set()
     for num in range(1, num_of_bench + 1):
         print("Running benchmark {}/{}:".format(num, num_of_bench))
-        benchmark = rand_benchmark(save_dir + "/" + str(num))
+        benchmark = rand_benchmark(save_dir + "/" + str(num), seen_dfas)
         print("Summary for the {}th benchmark".format(num))
         print(benchmark)
         if float(benchmark["rnn_testing_acc"]) < 90:
@@ -229,7 +235,7 @@ def run_extraction_on_dir(dir):
         if os.path.isfile(folder[0] + "/meta"):
             name = folder[0].split('/')[-1]
             rnn = RNNLanguageClasifier().load_lstm(folder[0])
-            dfa = load_dfa_dot(folder[0]+"/dfa.dot")
+            dfa = load_dfa(folder[0]+"/dfa")
             benchmark = {"name": name}
             extract(dfa, benchmark,rnn, folder[0])
             if first_entry:
@@ -246,8 +252,8 @@ def remasure_extraction_on_dir(dir):
             start_time = time.time()
             name = folder[0].split('/')[-1]
             rnn = RNNLanguageClasifier().load_lstm(folder[0])
-            dfa = load_dfa_dot(folder[0]+"/dfa.dot")
-            dfa_extracted = load_dfa_dot(folder[0]+"/dfa_extract-extracted_3.dot")
+            dfa = load_dfa(folder[0]+"/dfa")
+            dfa_extracted = load_dfa(folder[0]+"/dfa_extract-extracted_3")
             benchmark = {"name": name}
             compute_distances_no_model_checking([dfa,rnn,dfa_extracted], benchmark, epsilon= 0.0002, delta=0.005)
             print("masured in {}s".format(time.time()-start_time))
@@ -7,12 +7,11 @@ import numpy as np
 
 from dfa import DFA, random_dfa, dfa_intersection, save_dfa_as_part_of_model, DFANoisy
 from dfa_check import DFAChecker
-from exact_teacher import ExactTeacher
 from learner_decison_tree import DecisionTreeLearner
 from lstar.Extraction import extract as extract_iclm
 from modelPadding import RNNLanguageClasifier
 from pac_teacher import PACTeacher
-from random_words import confidence_interval_many, random_word, confidence_interval_subset
+from random_words import confidence_interval_many_streaming, confidence_interval_subset
 
 FIELD_NAMES = ["alph_len",
 
@@ -36,13 +35,6 @@ def write_line_csv(filename, benchmark):
         writer.writerow(benchmark)
 
 
-def minimize_dfa(dfa: DFA) -> DFA:
-    teacher_pac = ExactTeacher(dfa)
-    student = DecisionTreeLearner(teacher_pac)
-    teacher_pac.teach(student)
-    return student.dfa
-
-
 def learn_dfa(dfa: DFA, benchmark, hidden_dim=-1, num_layers=-1, embedding_dim=-1, batch_size=-1,
               epoch=-1, num_of_exm_per_length=-1, word_training_length=-1):
     if hidden_dim == -1:
@@ -108,7 +100,7 @@ def check_rnn_acc_to_spec(dfa, benchmark, timeout=900):
     teacher_pac.teach(student, timeout=timeout)
     benchmark.update({"extraction_time": "{:.3}".format(time.time() - start_time)})
 
-    dfa_extract = minimize_dfa(student.dfa)
+    dfa_extract = student.dfa.minimize()
     print(student.dfa)
     benchmark.update({"dfa_extract_states": len(dfa_extract.states),
                       "dfa_extract_final": len(dfa_extract.final_states)})
@@ -118,7 +110,7 @@ def check_rnn_acc_to_spec(dfa, benchmark, timeout=900):
 
 def compute_distances(models, benchmark, epsilon=0.005, delta=0.001):
     print("Starting distance measuring")
-    output, samples = confidence_interval_many(models, random_word, width=epsilon, confidence=delta)
+    output = confidence_interval_many_streaming(models, width=epsilon, confidence=delta)
     print("The confidence interval for epsilon = {} , delta = {}".format(delta, epsilon))
     print(output)
 
@@ -139,7 +131,7 @@ def rand_benchmark(save_dir=None):
     max_final = np.random.randint(6, 40)
 
     dfa_rand = random_dfa(alphabet, min_states=max_final + 1, max_states=50, min_final=5, max_final=max_final)
-    dfa = minimize_dfa(dfa_rand)
+    dfa = dfa_rand.minimize()
 
     benchmark.update({"dfa_states": len(dfa.states), "dfa_final": len(dfa.final_states)})
 
@@ -1,7 +1,16 @@
+import itertools
+import json
+import operator
 import os
 import string
+import struct
+import zipfile
+from collections import deque
+from collections.abc import Mapping
 
 import numpy as np
+from scipy.sparse import csr_matrix, identity
+from scipy.sparse.linalg import bicgstab
 from IPython.display import Image
 from IPython.display import display
 
@@ -11,6 +20,149 @@ import functools
 digraph = functools.partial(gv.Digraph, format='png')
 graph = functools.partial(gv.Graph, format='png')
 separator = "_"
+DFA_FILE_VERSION = 1
+
+
+class CompiledDFA:
+    """
+    Array form of a DFA: the states are renumbered 0..n-1 (the initial state is always 0), the letters 0..k-1,
+    the transition function is a dense (n, k) int32 matrix and the final states are a boolean mask.
+    """
+
+    def __init__(self, labels, alphabet, transitions, accepting):
+        self.labels = labels
+        self.alphabet = alphabet
+        self.transitions = transitions
+        self.accepting = accepting
+        self.init_state = 0
+        self.letter_index = {letter: i for i, letter in enumerate(alphabet)}
+        self._state_index = None
+        self._rows = None
+        self._accepting_list = None
+
+    # The following are built on first use, a large compiled DFA (e.g. a product) may only be used through its
+    # arrays.
+
+    @property
+    def state_index(self):
+        if self._state_index is None:
+            self._state_index = {label: i for i, label in enumerate(self.labels)}
+        return self._state_index
+
+    @property
+    def rows(self):
+        """
+        Plain python copy of the transitions for walking a single word, indexing numpy arrays one element at a time
+        is slower.
+        """
+        if self._rows is None:
+            self._rows = self.transitions.tolist()
+        return self._rows
+
+    @property
+    def accepting_list(self):
+        if self._accepting_list is None:
+            self._accepting_list = self.accepting.tolist()
+        return self._accepting_list
+
+    @classmethod
+    def from_dfa(cls, dfa):
+        labels = [dfa.init_state] + [state for state in dfa.transitions.keys() if state != dfa.init_state]
+        state_index = {label: i for i, label in enumerate(labels)}
+        alphabet = list(dfa.alphabet)
+
+        transitions = np.empty((len(labels), len(alphabet)), dtype=np.int32)
+        for i, state in enumerate(labels):
+            tran = dfa.transitions[state]
+            transitions[i] = [state_index[tran[letter]] for letter in alphabet]
+
+        final_states = set(dfa.final_states)
+        accepting = np.array([state in final_states for state in labels], dtype=bool)
+        return cls(labels, alphabet, transitions, accepting)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def encode_word(self, word):
+        return [self.letter_index[letter] for letter in word]
+
+    def run(self, encoded_word, state=0):
+        rows = self.rows
+        for letter in encoded_word:
+            state = rows[state][letter]
+        return state
+
+    def is_word_in(self, word):
+        rows, letter_index = self.rows, self.letter_index
+        state = 0
+        for letter in word:
+            state = rows[state][letter_index[letter]]
+        return self.accepting_list[state]
+
+    def encode_words(self, words):
+        """
+        Encodes a list of words into the CSR layout: a flat int array of all the letters and the offsets of the words
+        in it (word i is letters[offsets[i]:offsets[i + 1]]).
+        """
+        lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        letters = np.fromiter(map(self.letter_index.__getitem__, itertools.chain.from_iterable(words)),
+                              dtype=np.int32, count=int(offsets[-1]))
+        return letters, offsets
+
+    def run_csr(self, letters, offsets):
+        """
+        Runs all the words of a CSR batch together, one time step at a time. Returns the states they end in.
+        """
+        letters = np.asarray(letters)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        starts = offsets[:-1]
+        lengths = offsets[1:] - starts
+
+        # Sorting the words from the longest to the shortest, the words still running at step t are a prefix.
+        order = np.argsort(-lengths, kind="stable")
+        starts = starts[order]
+        max_length = int(lengths[order[0]]) if len(order) != 0 else 0
+        running = len(order) - np.searchsorted(np.sort(lengths), np.arange(max_length), side="right")
+
+        states = np.zeros(len(order), dtype=np.int32)
+        for t in range(max_length):
+            m = running[t]
+            states[:m] = self.transitions[states[:m], letters[starts[:m] + t]]
+
+        end_states = np.empty_like(states)
+        end_states[order] = states
+        return end_states
+
+    def run_padded(self, encoded_words, lengths):
+        """
+        Runs all the words of a padded (#words, max length) matrix together, one time step at a time.
+        Returns the states they end in.
+        """
+        encoded_words = np.asarray(encoded_words)
+        lengths = np.asarray(lengths)
+        num_of_letters = len(self.alphabet)
+        # An extra letter for the padding that leaves every state in place.
+        transitions = np.concatenate([self.transitions, np.arange(len(self), dtype=np.int32)[:, None]], axis=1)
+        padded = np.where(np.arange(encoded_words.shape[1]) < lengths[:, None], encoded_words, num_of_letters)
+
+        states = np.zeros(len(lengths), dtype=np.int32)
+        for t in range(padded.shape[1]):
+            states = transitions[states, padded[:, t]]
+        return states
+
+    def is_words_in_batch(self, words, lengths=None, offsets=None):
+        if offsets is not None:
+            states = self.run_csr(words, offsets)
+        elif lengths is not None:
+            states = self.run_padded(words, lengths)
+        else:
+            # Words that are not encoded yet have to be read letter by letter anyway, walking them right away is
+            # cheaper than encoding them first.
+            is_word_in = self.is_word_in
+            return np.fromiter(map(is_word_in, words), dtype=bool, count=len(words))
+        return self.accepting[states]
 
 
 class DFA:
@@ -21,12 +173,31 @@ class DFA:
         self.states = transitions.keys()
         self.alphabet = list(transitions[init_state].keys())
         self.current_state = self.init_state
+        self._compiled = None
+        self._canonical = None
+
+    @property
+    def compiled(self) -> CompiledDFA:
+        """
+        The array form of this DFA, built on first use. The DFA is not expected to change after that.
+        """
+        if self._compiled is None:
+            self._compiled = CompiledDFA.from_dfa(self)
+        return self._compiled
 
     def is_word_in(self, word):
-        state = self.init_state
-        for letter in word:
-            state = self.transitions[state][letter]
-        return state in self.final_states
+        return self.compiled.is_word_in(word)
+
+    def is_words_in_batch(self, words, lengths=None, offsets=None):
+        """
+        Classifies many words at once by advancing all of them together over the compiled transition table.
+        The words are either:
+            a list of words (as for RNNLanguageClasifier.is_words_in_batch),
+            a padded int matrix of encoded words (letters as indices in self.alphabet) together with their lengths,
+            a CSR batch: a flat int array of encoded letters together with the offsets of the words in it.
+        Returns a boolean numpy array.
+        """
+        return self.compiled.is_words_in_batch(words, lengths, offsets)
 
     def next_state_by_letter(self, state, letter):
         next_state = self.transitions[state][letter]
@@ -45,71 +216,150 @@ class DFA:
     def reset_current_to_init(self):
         self.current_state = self.init_state
 
-    def equivalence_with_counterexample(self, other):
+    def _cross_product_counterexample(self, other, is_counterexample):
         """
-        Check if equal to another DFA by traversing their cross product.
-        If equal returns None, otherwise returns a counter example.
-
+        BFS over the cross product of self and other on their compiled forms, looking for a pair of states for which
+        is_counterexample(accepting in self, accepting in other) holds.
+        A pair (s1, s2) is kept as the single int s1 * |other| + s2. Since the pairs are checked when they are first
+        reached in BFS order, the returned word is a shortest one. Returns None if there is no such word.
         """
-        if self.is_word_in(tuple()) != other.is_word_in(tuple()):
+        compiled1, compiled2 = self.compiled, other.compiled
+        rows1, rows2 = compiled1.rows, compiled2.rows
+        accepting1, accepting2 = compiled1.accepting_list, compiled2.accepting_list
+        num_of_states2 = len(compiled2)
+        # other may list the same letters in a different order
+        letters = [(l1, compiled2.letter_index[letter]) for l1, letter in enumerate(compiled1.alphabet)]
+
+        if is_counterexample(accepting1[0], accepting2[0]):
             return tuple()
 
-        cross_states = {(self.init_state, other.init_state): (tuple(), None)}
-        to_check = [(self.init_state, other.init_state)]
-        alphabet = self.alphabet
+        # pair -> (the pair it was reached from, the letter it was reached by)
+        back_pointers = {0: None}
+        to_check = deque([0])
 
         while len(to_check) != 0:
-            s1, s2 = to_check.pop(0)
-            for l in alphabet:
-                q1 = self.next_state_by_letter(s1, l)
-                q2 = other.next_state_by_letter(s2, l)
-
-                if (q1 in self.final_states) != (q2 in other.final_states):
-                    counter_example = tuple([l])
-                    q1, q2 = s1, s2
-
-                    while (q1 != self.init_state) | (q2 != other.init_state):
-                        l, q1, q2 = cross_states.get((q1, q2))
-                        counter_example = tuple([l]) + counter_example
-                    return counter_example
-
-                if cross_states.get((q1, q2)) is None:
-                    to_check.append((q1, q2))
-                    cross_states.update({(q1, q2): (l, s1, s2)})
+            pair = to_check.popleft()
+            s1, s2 = divmod(pair, num_of_states2)
+            row1, row2 = rows1[s1], rows2[s2]
+            for l1, l2 in letters:
+                q1, q2 = row1[l1], row2[l2]
+                next_pair = q1 * num_of_states2 + q2
+                if next_pair in back_pointers:
+                    continue
+                back_pointers[next_pair] = (pair, l1)
+
+                if is_counterexample(accepting1[q1], accepting2[q2]):
+                    counter_example = []
+                    while back_pointers[next_pair] is not None:
+                        next_pair, letter = back_pointers[next_pair]
+                        counter_example.append(compiled1.alphabet[letter])
+                    return tuple(reversed(counter_example))
+
+                to_check.append(next_pair)
         return None
 
+    def equivalence_with_counterexample(self, other):
+        """
+        Check if equal to another DFA by traversing their cross product.
+        If equal returns None, otherwise returns a counter example.
+
+        """
+        return self._cross_product_counterexample(other, lambda in1, in2: in1 != in2)
+
     def is_language_not_subset_of(self, other):
         """
-        Checks whether this DFA's language is a subset of the language of other (checking A \cap A'^c != 0),
+        Checks whether this DFA's language is a subset of the language of other (checking A \\cap A'^c != 0),
         by traversing the cross product of self and the complimentary of other.
         If equal returns None, otherwise returns a counter example.
         """
-        if self.is_word_in(tuple()) & (not other.is_word_in(tuple())):
-            return tuple()
+        return self._cross_product_counterexample(other, lambda in1, in2: in1 and not in2)
 
-        cross_states = {(self.init_state, other.init_state): (tuple(), None)}
-        to_check = [(self.init_state, other.init_state)]
-        alphabet = self.alphabet
-
-        while len(to_check) != 0:
-            s1, s2 = to_check.pop(0)
-            for l in alphabet:
-                q1 = self.next_state_by_letter(s1, l)
-                q2 = other.next_state_by_letter(s2, l)
-
-                if (q1 in self.final_states) and (q2 not in other.final_states):
-                    counter_example = tuple([l])
-                    q1, q2 = s1, s2
-
-                    while (q1 != self.init_state) | (q2 != other.init_state):
-                        l, q1, q2 = cross_states.get((q1, q2))
-                        counter_example = tuple([l]) + counter_example
-                    return counter_example
-
-                if cross_states.get((q1, q2)) is None:
-                    to_check.append((q1, q2))
-                    cross_states.update({(q1, q2): (l, s1, s2)})
-        return None
+    def minimize(self):
+        """
+        Returns the minimal DFA of the same language: the unreachable states are dropped and the rest are merged
+        using Hopcroft's partition refinement (O(n k log n)).
+        The result is canonical, its states are named by their shortest access word (the first one found by a BFS
+        from the initial state, going over the letters in the order of the alphabet), the initial state being ().
+        """
+        compiled = self.compiled
+        rows = compiled.rows
+        num_of_letters = len(compiled.alphabet)
+
+        # Pruning the unreachable states, the reachable ones are renumbered in BFS order.
+        reachable = [0]
+        index = {0: 0}
+        for state in reachable:
+            for q in rows[state]:
+                if q not in index:
+                    index[q] = len(reachable)
+                    reachable.append(q)
+        num_of_states = len(reachable)
+        delta = [[index[q] for q in rows[state]] for state in reachable]
+        accepting = [compiled.accepting_list[state] for state in reachable]
+
+        predecessors = [[[] for _ in range(num_of_states)] for _ in range(num_of_letters)]
+        for state in range(num_of_states):
+            for letter, q in enumerate(delta[state]):
+                predecessors[letter][q].append(state)
+
+        # Hopcroft's partition refinement, starting from {final, not final}.
+        final = {s for s in range(num_of_states) if accepting[s]}
+        not_final = set(range(num_of_states)) - final
+        blocks = [block for block in (final, not_final) if len(block) != 0]
+        block_of = [0] * num_of_states
+        for i, block in enumerate(blocks):
+            for s in block:
+                block_of[s] = i
+
+        waiting = set()
+        if len(blocks) == 2:
+            smaller = 0 if len(blocks[0]) <= len(blocks[1]) else 1
+            waiting = {(smaller, letter) for letter in range(num_of_letters)}
+
+        while len(waiting) != 0:
+            splitter, letter = waiting.pop()
+            touched = {}
+            preds = predecessors[letter]
+            for q in blocks[splitter]:
+                for s in preds[q]:
+                    touched.setdefault(block_of[s], set()).add(s)
+
+            for block, inside in touched.items():
+                if len(inside) == len(blocks[block]):
+                    continue
+                blocks[block] -= inside
+                new_block = len(blocks)
+                blocks.append(inside)
+                for s in inside:
+                    block_of[s] = new_block
+                for c in range(num_of_letters):
+                    if (block, c) in waiting:
+                        waiting.add((new_block, c))
+                    elif len(inside) <= len(blocks[block]):
+                        waiting.add((new_block, c))
+                    else:
+                        waiting.add((block, c))
+
+        # Naming the blocks by their shortest access words.
+        names = {block_of[0]: tuple()}
+        to_visit = [block_of[0]]
+        transitions = {}
+        final_states = []
+        for block in to_visit:
+            name = names[block]
+            representative = next(iter(blocks[block]))
+            if accepting[representative]:
+                final_states.append(name)
+            tran = {}
+            for letter in range(num_of_letters):
+                next_block = block_of[delta[representative][letter]]
+                if next_block not in names:
+                    names[next_block] = name + tuple([compiled.alphabet[letter]])
+                    to_visit.append(next_block)
+                tran.update({compiled.alphabet[letter]: names[next_block]})
+            transitions.update({name: tran})
+
+        return DFA(tuple(), final_states, transitions)
 
     def save(self, filename):
         with open(filename + ".dot", "w") as file:
@@ -125,34 +375,99 @@ class DFA:
 
             file.write('__start0 -> {}\n'.format(self.init_state))
 
-            for s1 in self.transitions.keys():
+            for s1 in self.states:
                 tran = self.transitions[s1]
                 for letter in tran.keys():
                     file.write('{} -> {}[label="{}"]\n'.format(s1, tran[letter], letter))
             file.write("}\n")
 
-    def __eq__(self, other):
-        if self.is_word_in("") != other.is_word_in(""):
-            return ""
+    def save_npz(self, filename):
+        """
+        Saves in the binary format (see load_dfa_npz) to filename.npz. The .dot format of save is kept for drawing.
+        The state labels and the letters are stored together as one json string (read back with tuples for lists), so
+        they should be strings, numbers or tuples of them, as all the labels used here are.
+        """
+        compiled = self.compiled
+        np.savez(filename + ".npz",
+                 version=np.array(DFA_FILE_VERSION),
+                 names=np.array(json.dumps([compiled.alphabet, compiled.labels])),
+                 transitions=compiled.transitions,
+                 accepting=compiled.accepting)
 
-        cross_states = {(self.init_state, other.init_state): ("", None)}
-        to_check = [(self.init_state, other.init_state)]
-        alphabet = self.alphabet
+    def __eq__(self, other):
+        """
+        Language equivalence by Hopcroft and Karp's union-find algorithm, near linear in the number of states.
+        Use equivalence_with_counterexample to also get a (shortest) word on which the two DFAs differ.
+        """
+        if (self._canonical is not None) and (other._canonical is not None):
+            return self._canonical == other._canonical
+
+        compiled1, compiled2 = self.compiled, other.compiled
+        rows1, rows2 = compiled1.rows, compiled2.rows
+        accepting1, accepting2 = compiled1.accepting_list, compiled2.accepting_list
+        letters = [(l1, compiled2.letter_index[letter]) for l1, letter in enumerate(compiled1.alphabet)]
+
+        # The states of other are numbered after those of self, each class only holds states that agree on
+        # acceptance.
+        offset = len(compiled1)
+        parent = list(range(offset + len(compiled2)))
+
+        def find(state):
+            while parent[state] != state:
+                parent[state] = parent[parent[state]]
+                state = parent[state]
+            return state
+
+        if accepting1[0] != accepting2[0]:
+            return False
+        parent[0] = offset
+        to_check = [(0, 0)]
 
         while len(to_check) != 0:
-            s1, s2 = to_check.pop(0)
-            for l in alphabet:
-                q1 = self.next_state_by_letter(s1, l)
-                q2 = other.next_state_by_letter(s2, l)
-
-                if (q1 in self.final_states) != (q2 in other.final_states):
+            s1, s2 = to_check.pop()
+            row1, row2 = rows1[s1], rows2[s2]
+            for l1, l2 in letters:
+                q1, q2 = row1[l1], row2[l2]
+                root1, root2 = find(q1), find(offset + q2)
+                if root1 == root2:
+                    continue
+                if accepting1[q1] != accepting2[q2]:
                     return False
-
-                if cross_states.get((q1, q2)) is None:
-                    to_check.append((q1, q2))
-                    cross_states.update({(q1, q2): (l, s1, s2)})
+                parent[root1] = root2
+                to_check.append((q1, q2))
         return True
 
+    def __hash__(self):
+        return hash(self.canonical_form())
+
+    def canonical_form(self):
+        """
+        Returns (letters, transitions, final) describing the minimal DFA of the language: the letters sorted, the
+        states numbered in BFS order from the initial state (which is 0), transitions as the bytes of the (n, k) int32
+        matrix and final as the bytes of the accepting mask.
+        Two DFAs over the same alphabet have the same canonical form iff they accept the same language, which makes
+        the form usable for hashing and O(n k) comparisons. It is computed once per DFA.
+        """
+        if self._canonical is None:
+            minimal = self.minimize().compiled
+            letters = sorted(minimal.alphabet, key=repr)
+            columns = [minimal.letter_index[letter] for letter in letters]
+
+            order = [0]
+            index = {0: 0}
+            for state in order:
+                for letter in columns:
+                    q = minimal.rows[state][letter]
+                    if q not in index:
+                        index[q] = len(order)
+                        order.append(q)
+
+            transitions = np.array([[index[minimal.rows[state][letter]] for letter in columns] for state in order],
+                                   dtype=np.int32).reshape(len(order), len(columns))
+            accepting = minimal.accepting[order]
+            self._canonical = (tuple(letters), transitions.tobytes(), accepting.tobytes())
+        return self._canonical
+
     def __repr__(self):
         return str(len(self.states)) + " states, " + str(len(self.final_states)) + " final states and " + \
                str(len(self.alphabet)) + " letters."
@@ -161,7 +476,7 @@ class DFA:
     def draw_nicely(self, force=False, maximum=60,
                     name="dfa", save_dir="img/"):  # todo: if two edges are identical except for letter, merge them
         # and note both the letters
-        if (not force) and len(self.transitions) > maximum:
+        if (not force) and len(self.states) > maximum:
             return
 
         # suspicion: graphviz may be upset by certain sequences, avoid them in nodes
@@ -335,6 +650,108 @@ def load_dfa_dot(filename: str) -> DFA:
     return DFA(initial_state, final_states, transitions)
 
 
+def _lists_to_tuples(obj):
+    if isinstance(obj, list):
+        return tuple(_lists_to_tuples(item) for item in obj)
+    return obj
+
+
+def _memmap_npz_arrays(filename, names):
+    """
+    Memory maps arrays stored (uncompressed, as np.savez does) inside an .npz file.
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, "rb") as file:
+        for name in names:
+            info = archive.getinfo(name + ".npy")
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise Exception("{} in {} is compressed and can not be memory mapped".format(name, filename))
+            # skipping the zip local file header to the .npy data
+            file.seek(info.header_offset)
+            local_header = file.read(30)
+            name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            arrays[name] = np.memmap(filename, dtype=dtype, mode="r", offset=file.tell(), shape=shape,
+                                     order="F" if fortran_order else "C")
+    return arrays
+
+
+class _CompiledTransitions(Mapping):
+    """
+    The transitions of a DFA as a read only view of its compiled form: all the states are keys, the transitions of a
+    state are created when it is first looked up.
+    """
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+        self._created = {}
+
+    def __getitem__(self, state):
+        tran = self._created.get(state)
+        if tran is None:
+            compiled = self.compiled
+            row = compiled.transitions[compiled.state_index[state]].tolist()
+            tran = {letter: compiled.labels[q] for letter, q in zip(compiled.alphabet, row)}
+            self._created[state] = tran
+        return tran
+
+    def __iter__(self):
+        return iter(self.compiled.labels)
+
+    def __len__(self):
+        return len(self.compiled.labels)
+
+
+def load_dfa_npz(filename: str, mmap=False) -> DFA:
+    """
+    Loads a DFA saved by DFA.save_npz. The file holds a format version, the alphabet, the state labels (the initial
+    state first), the int32 transition matrix and the accepting mask.
+    If mmap is True the transition matrix and the accepting mask are memory mapped instead of read, and the
+    transitions of the DFA are a view of them (see _CompiledTransitions) so only the rows that are used are read.
+    """
+    with np.load(filename) as archive:
+        version = int(archive["version"])
+        if version != DFA_FILE_VERSION:
+            raise Exception("{} is of version {}, only version {} is supported".format(filename, version,
+                                                                                      DFA_FILE_VERSION))
+        alphabet, labels = [list(names) for names in _lists_to_tuples(json.loads(str(archive["names"])))]
+        if mmap:
+            arrays = _memmap_npz_arrays(filename, ["transitions", "accepting"])
+            transitions, accepting = arrays["transitions"], arrays["accepting"]
+        else:
+            transitions, accepting = archive["transitions"], archive["accepting"]
+
+    compiled = CompiledDFA(labels, alphabet, transitions, accepting)
+    if mmap:
+        transitions_dict = _CompiledTransitions(compiled)
+    else:
+        transitions_dict = {labels[state]: {alphabet[letter]: labels[q] for letter, q in enumerate(row)}
+                            for state, row in enumerate(transitions.tolist())}
+    final_states = [labels[state] for state in np.flatnonzero(accepting)]
+    dfa = DFA(labels[0], final_states, transitions_dict)
+    dfa._compiled = compiled
+    return dfa
+
+
+def load_dfa(filename: str) -> DFA:
+    """
+    Loads filename.npz if it exists and filename.dot otherwise (filename may also end with either extension).
+    """
+    if filename.endswith(".npz"):
+        return load_dfa_npz(filename)
+    if filename.endswith(".dot"):
+        filename = filename[:-len(".dot")]
+    if os.path.exists(filename + ".npz"):
+        return load_dfa_npz(filename + ".npz")
+    return load_dfa_dot(filename + ".dot")
+
+
 def save_dfa_as_part_of_model(dir_name, dfa: DFA, name="dfa", force_overwrite=False):
     """
     Saves as a part of model, i.e. in a folder with an RNN and other information
@@ -345,24 +762,192 @@ def save_dfa_as_part_of_model(dir_name, dfa: DFA, name="dfa", force_overwrite=Fa
         if input("the save {} exists. Enter y if you want to overwrite it.".format(name)) != "y":
             return
     dfa.save(dir_name + "/" + name)
+    dfa.save_npz(dir_name + "/" + name)
 
 
 def dfa_intersection(model1: DFA, model2: DFA) -> DFA:
-    if model1.alphabet != model2.alphabet:
-        raise Exception("The two DFAs have different alphabets")
+    """
+    The (lazy) product DFA of model1 and model2 accepting the intersection of their languages, see ProductDFA.
+    """
+    return ProductDFA(model1, model2, "intersection")
+
+
+# How a pair of states of a product DFA is accepting given whether each of its two states is, these work both on
+# bools and on boolean numpy arrays.
+PRODUCT_OPERATIONS = {"intersection": operator.and_,
+                      "union": operator.or_,
+                      "difference": operator.gt,
+                      "symmetric_difference": operator.ne}
+
 
-    new_states = [(state1, state2) for state1 in model1.states for state2 in model2.states]
-    new_init_states = (model1.init_state, model2.init_state)
-    new_final_states = [(state1, state2) for state1 in model1.final_states for state2 in model2.final_states]
-    new_transitions = {}
-    for (state1, state2) in new_states:
-        new_transitions[(state1, state2)] = {
-            letter: (model1.transitions[state1][letter], model2.transitions[state2][letter]) for letter in
-            model1.alphabet}
+# Products of up to this many pairs of states are explored with a boolean array over all the pairs, a level of the
+# BFS at a time. Larger ones with a dict holding only the reachable pairs.
+DENSE_PRODUCT_LIMIT = 1 << 25
+
+
+def _reachable_pairs_dense(transitions1, transitions2):
+    """
+    The pairs (as s1 * n2 + s2) reachable from (0, 0) in the product of two transition matrices with the same
+    letters, sorted, and the transition matrix between them (numbered by their place in pairs).
+    """
+    num_of_states2 = len(transitions2)
+    reached = np.zeros(len(transitions1) * num_of_states2, dtype=bool)
+    reached[0] = True
+    frontier = np.zeros(1, dtype=np.int64)
+    while len(frontier) != 0:
+        successors = transitions1[frontier // num_of_states2].astype(np.int64) * num_of_states2 + \
+                     transitions2[frontier % num_of_states2]
+        frontier = np.unique(successors[~reached[successors]])
+        reached[frontier] = True
+
+    pairs = np.flatnonzero(reached)
+    successors = transitions1[pairs // num_of_states2].astype(np.int64) * num_of_states2 + \
+                 transitions2[pairs % num_of_states2]
+    return pairs, np.searchsorted(pairs, successors).astype(np.int32)
+
+
+def _reachable_pairs_sparse(rows1, rows2):
+    """
+    As _reachable_pairs_dense, on the rows as lists, with a BFS whose memory is linear in the reachable pairs.
+    The pairs are in BFS order.
+    """
+    num_of_states2 = len(rows2)
+    index = {0: 0}
+    pairs = [0]
+    transitions = []
+    for pair in pairs:
+        row = []
+        for q1, q2 in zip(rows1[pair // num_of_states2], rows2[pair % num_of_states2]):
+            next_pair = q1 * num_of_states2 + q2
+            if next_pair not in index:
+                index[next_pair] = len(pairs)
+                pairs.append(next_pair)
+            row.append(index[next_pair])
+        transitions.append(row)
+    return np.array(pairs, dtype=np.int64), np.array(transitions, dtype=np.int32).reshape(len(pairs), len(rows1[0]))
+
+
+class _ProductTransitions(dict):
+    """
+    The transitions of a ProductDFA, the transitions of a pair of states are created when it is first looked up.
+    """
 
-    new_dfa = DFA(new_init_states, new_final_states, new_transitions)
+    def __init__(self, product):
+        super().__init__()
+        self.product = product
 
-    return new_dfa
+    def __missing__(self, state):
+        state1, state2 = state
+        transitions1, transitions2 = self.product.dfa1.transitions[state1], self.product.dfa2.transitions[state2]
+        tran = {letter: (transitions1[letter], transitions2[letter]) for letter in self.product.alphabet}
+        self[state] = tran
+        return tran
+
+
+class _ProductFinalStates:
+    """
+    The final states of a ProductDFA. Membership is decided from the two states, only going over all the final
+    states needs the reachable part of the product.
+    """
+
+    def __init__(self, product):
+        self.product = product
+
+    def __contains__(self, state):
+        state1, state2 = state
+        return bool(self.product.accepts(state1 in self.product.dfa1.final_states,
+                                         state2 in self.product.dfa2.final_states))
+
+    def __iter__(self):
+        compiled = self.product.compiled
+        return (compiled.labels[state] for state in np.flatnonzero(compiled.accepting))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.product.compiled.accepting))
+
+
+class ProductDFA(DFA):
+    """
+    The product of two DFAs over the same alphabet, the states are the pairs (state of dfa1, state of dfa2).
+    operation is one of PRODUCT_OPERATIONS and says which pairs are accepting.
+
+    Nothing is built in advance: is_word_in, next_state_by_letter, etc. create the transitions of the pairs they
+    visit. compiled holds only the reachable pairs, found by a BFS over the compiled forms of dfa1 and dfa2, and
+    everything that works on the compiled form (is_words_in_batch, ==, minimize, is_language_not_subset_of,
+    dfa_distance...) never goes over all the |Q1| x |Q2| pairs. states, and going over final_states, compile.
+    """
+
+    def __init__(self, dfa1: DFA, dfa2: DFA, operation="intersection"):
+        if set(dfa1.alphabet) != set(dfa2.alphabet):
+            raise Exception("The two DFAs have different alphabets")
+        if operation not in PRODUCT_OPERATIONS:
+            raise Exception("Unknown product operation {}, expected one of {}".format(operation,
+                                                                                     list(PRODUCT_OPERATIONS)))
+        self.dfa1, self.dfa2 = dfa1, dfa2
+        self.operation = operation
+        self.accepts = PRODUCT_OPERATIONS[operation]
+        self.init_state = (dfa1.init_state, dfa2.init_state)
+        self.alphabet = list(dfa1.alphabet)
+        self.transitions = _ProductTransitions(self)
+        self.final_states = _ProductFinalStates(self)
+        self.current_state = self.init_state
+        self._compiled = None
+        self._canonical = None
+
+    @property
+    def states(self):
+        return self.compiled.labels
+
+    @property
+    def compiled(self) -> CompiledDFA:
+        if self._compiled is None:
+            self._compiled = self._compile_reachable()
+        return self._compiled
+
+    def _compile_reachable(self):
+        compiled1, compiled2 = self.dfa1.compiled, self.dfa2.compiled
+        transitions2 = compiled2.transitions[:, [compiled2.letter_index[letter] for letter in compiled1.alphabet]]
+        # A pair (s1, s2) is kept as the single int s1 * |dfa2| + s2.
+        if len(compiled1) * len(compiled2) <= DENSE_PRODUCT_LIMIT:
+            pairs, transitions = _reachable_pairs_dense(compiled1.transitions, transitions2)
+        else:
+            pairs, transitions = _reachable_pairs_sparse(compiled1.rows, transitions2.tolist())
+
+        states1, states2 = np.divmod(pairs, len(compiled2))
+        labels = [(compiled1.labels[s1], compiled2.labels[s2]) for s1, s2 in zip(states1.tolist(), states2.tolist())]
+        accepting = self.accepts(compiled1.accepting[states1], compiled2.accepting[states2])
+        return CompiledDFA(labels, list(compiled1.alphabet), transitions, accepting)
+
+    def is_word_in(self, word):
+        if self._compiled is not None:
+            return self._compiled.is_word_in(word)
+        state = self.init_state
+        for letter in word:
+            state = self.transitions[state][letter]
+        return state in self.final_states
+
+
+def dfa_distance(dfa1: DFA, dfa2: DFA, p=0.01):
+    """
+    The exact probability that dfa1 and dfa2 disagree on a word drawn as by random_word, i.e. a word that stops with
+    probability p before each letter and whose letters are uniform over the alphabet. This is the value that
+    confidence_interval_many estimates by sampling.
+    With x the vector of disagreement probabilities from the reachable pairs of the product automaton, M its
+    (letter counting) transition matrix and d the indicator of the pairs that disagree on acceptance,
+    x = p * d + (1 - p) / |alphabet| * M x, which is a single sparse linear system. The system is diagonally
+    dominant, so it is solved iteratively (a direct factorization fills in badly on large product automata).
+    """
+    product = ProductDFA(dfa1, dfa2, "symmetric_difference").compiled
+    num_of_states, num_of_letters = product.transitions.shape
+
+    move = csr_matrix((np.full(product.transitions.size, (1 - p) / num_of_letters),
+                       (np.repeat(np.arange(num_of_states), num_of_letters), product.transitions.ravel())),
+                      shape=(num_of_states, num_of_states))
+    distances, info = bicgstab(identity(num_of_states, format="csr") - move, p * product.accepting.astype(np.float64),
+                               rtol=1e-12, atol=0)
+    if info != 0:
+        raise Exception("The distance computation did not converge")
+    return float(distances[0])
 
 
 class DFANoisy(DFA):
@@ -375,10 +960,7 @@ class DFANoisy(DFA):
         if word in self.known_mistakes:
             return self.known_mistakes[word]
 
-        state = self.init_state
-        for letter in word:
-            state = self.transitions[state][letter]
-        label = state in self.final_states
+        label = self.compiled.is_word_in(word)
 
         if np.random.randint(0, int(1 / self.mistake_prob)) == 0:
             self.known_mistakes.update({word: not label})
@@ -386,3 +968,9 @@ class DFANoisy(DFA):
         else:
             self.known_mistakes.update({word: label})
             return label
+
+    def is_words_in_batch(self, words, lengths=None, offsets=None):
+        # The mistakes are remembered per word, so the words are classified one by one.
+        if (lengths is not None) or (offsets is not None):
+            raise Exception("DFANoisy only classifies batches given as a list of words")
+        return np.array([self.is_word_in(w) for w in words], dtype=bool)
@@ -18,25 +18,6 @@ class DFAChecker(ModelChecker, ABC):
         #     sup_dfa = dfa
         #     inf_dfa = self.specification
 
-        dfs_stack = []
-        word_path = ()
-
-        dfs_stack.append([(dfa.init_state, self.specification.init_state), word_path])
-        visited = []
-
-        while len(dfs_stack) != 0:
-            [(model_state, spec_state), word_path] = dfs_stack.pop(0)
-            if (model_state, spec_state) in visited:
-                continue
-            else:
-                visited.append((model_state, spec_state))
-
-            if dfa.is_final_state(model_state) and not (self.specification.is_final_state(spec_state)):
-                return word_path
-
-            for letter in dfa.alphabet:
-                dfs_stack.append([(dfa.next_state_by_letter(model_state, letter), \
-                                   self.specification.next_state_by_letter(spec_state, letter)),
-                                  word_path + tuple([letter])])
-
-        return None
+        # Searching the cross product of the model and the complement of the specification, done on the compiled
+        # (integer) forms of both DFAs.
+        return dfa.is_language_not_subset_of(self.specification)
@@ -4,14 +4,14 @@ from teacher import Teacher
 
 class ExactTeacher(Teacher):
 
-    def __init__(self, model: DFA):
-        Teacher.__init__(self, model)
+    def __init__(self, model: DFA, oracle=None):
+        Teacher.__init__(self, model, oracle)
 
     def equivalence_query(self, dfa):
         return self.model.equivalence_with_counterexample(dfa)
 
     def membership_query(self, w):
-        return self.model.is_word_in(w)
+        return self.oracle.is_word_in(w)
 
     def teach(self, learner):
         learner.teacher = self
@@ -1,178 +1,257 @@
+from array import array
+from itertools import islice
+
+import numpy as np
 from graphviz import Digraph
 
 from dfa import DFA
 from learner import Learner
+from word_trie import WordTrie
 
 
-class TreeNode:
-    def __init__(self, name=tuple(), in_lan=True, parent=None):
-        self.right = None
-        self.left = None
-        self.name = name
-        self.inLan = in_lan
-        self.parent = parent
-
-        if parent is not None:
-            self.depth = parent.depth + 1
-        else:
-            self.depth = 0
-
-    def __repr__(self):
-        return "TreeNode: name: \'" + self.name + "\', depth:" + str(self.depth)
+class DiscriminationTree:
+    """
+    The discrimination tree of DecisionTreeLearner. A node is an index into parallel typed arrays: left, right (-1
+    at leafs), parent (-1 at the root), depth, name_id (the WordTrie id of the access string at a leaf, of the
+    discriminator at an inner node) and in_lan, names keeps the names as tuples. Walks read the arrays by index,
+    batches read them through numpy views (see view).
+    The tree only grows by splitting leafs, so the ancestors of a node never change and the 2^k-th ancestors kept
+    for binary lifting are set once, when the node is added.
+    """
+    __slots__ = ["left", "right", "parent", "depth", "name_id", "in_lan", "names", "_up"]
+
+    ROOT = 0
+
+    def __init__(self, in_lan):
+        self.left = array("q")
+        self.right = array("q")
+        self.parent = array("q")
+        self.depth = array("q")
+        self.name_id = array("q")
+        self.in_lan = array("b")
+        self.names = []
+        # _up[k][node] is the 2^k-th ancestor of node (the root if there is none)
+        self._up = [array("q")]
+        self.add_node(-1, tuple(), WordTrie.EMPTY, in_lan)
+
+    def __len__(self):
+        return len(self.left)
+
+    @staticmethod
+    def view(field):
+        """
+        A numpy array over a field, without a copy. It is only valid until the next node is added.
+        """
+        return np.frombuffer(field, dtype=np.int64 if field.typecode == "q" else np.int8)
+
+    def add_node(self, parent, name, name_id, in_lan):
+        node = len(self.left)
+        depth = 0 if parent < 0 else self.depth[parent] + 1
+        self.left.append(-1)
+        self.right.append(-1)
+        self.parent.append(parent)
+        self.depth.append(depth)
+        self.name_id.append(name_id)
+        self.in_lan.append(in_lan)
+        self.names.append(name)
+
+        if depth >= 1 << len(self._up):
+            self._up.append(array("q", [self._up[-1][ancestor] for ancestor in self._up[-1]]))
+        self._up[0].append(node if parent < 0 else parent)
+        for k in range(1, len(self._up)):
+            self._up[k].append(self._up[k - 1][self._up[k - 1][node]])
+        return node
+
+    def set_name(self, node, name, name_id):
+        self.names[node] = name
+        self.name_id[node] = name_id
+
+    def is_leaf(self, node):
+        return self.left[node] < 0
+
+    def common_ancestor(self, node1, node2):
+        if self.depth[node1] < self.depth[node2]:
+            node1, node2 = node2, node1
+        difference = self.depth[node1] - self.depth[node2]
+        k = 0
+        while difference != 0:
+            if difference & 1:
+                node1 = self._up[k][node1]
+            difference >>= 1
+            k += 1
+        if node1 == node2:
+            return node1
+        for up in reversed(self._up):
+            if up[node1] != up[node2]:
+                node1, node2 = up[node1], up[node2]
+        return self._up[0][node1]
 
     def draw(self, filename):
         graph = Digraph('G', filename=filename)
-        front = []
-
-        if self.inLan:
-            graph.node(self.name, color="blue")
-        else:
-            graph.node(self.name, color="red")
-        if self.left is not None:
-            front.append(self.left)
-        if self.right is not None:
-            front.append(self.right)
-
-        while len(front) != 0:
-            v = front.pop(0)
-            is_leaf = True
-
-            if v.left is not None:
-                front.append(v.left)
-                is_leaf = False
-            if v.right is not None:
-                front.append(v.right)
-                is_leaf = False
-
-            if is_leaf:
-                name = v.name + "[leaf]"
-            else:
-                name = v.name
-
-            if v.inLan:
-                graph.node(name, color="blue")
-            else:
-                graph.node(name, color="red")
-
-            if v.parent.left == v:
-                graph.edge(v.parent.name, name, color="red", label="l")
-            else:
-                graph.edge(v.parent.name, name, color="blue", label="r")
-
+        for node in range(len(self)):
+            name = str(self.names[node]) + ("[leaf]" if self.is_leaf(node) else "")
+            graph.node(str(node), label=name, color="blue" if self.in_lan[node] else "red")
+            if self.parent[node] >= 0:
+                if self.left[self.parent[node]] == node:
+                    graph.edge(str(self.parent[node]), str(node), color="red", label="l")
+                else:
+                    graph.edge(str(self.parent[node]), str(node), color="blue", label="r")
         graph.view()
 
 
-def finding_common_ancestor(node1: TreeNode, node2: TreeNode):
-    # bring the nodes to the same depth:
-    if node1.depth < node2.depth:
-        while node1.depth != node2.depth:
-            node2 = node2.parent
-    else:
-        while node1.depth != node2.depth:
-            node1 = node1.parent
-
-    while node1 != node2:
-        node1, node2 = node1.parent, node2.parent
-
-    return node1
-
-
 class DecisionTreeLearner(Learner):
     """
     Implementation of the DFA learner from:
       Michael J. Kearns, Umesh Vazirani - An Introduction to Computational Learning Theory
+
+    counterexample_analysis - how new_counterexample finds where the hypothesis goes wrong on a counterexample:
+        "linear" - sifting the prefixes of the counterexample one after the other (as in the book),
+        "binary" - Rivest and Schapire's binary search, O(log(len(counterexample))) membership queries.
+
+    Inside the learner words are ids of self._words (a WordTrie), the sift cache is keyed by them and the tuples are
+    only built for the queries asked of the teacher and for the names of the hypothesis states. The answers are
+    remembered by the oracle of the teacher, shared with every other learner of the same model.
     """
 
-    def __init__(self, teacher):
+    def __init__(self, teacher, counterexample_analysis="linear"):
+        if counterexample_analysis not in ("linear", "binary"):
+            raise Exception("Unknown counterexample analysis {}".format(counterexample_analysis))
+        self.counterexample_analysis = counterexample_analysis
         self.teacher = teacher
-        self._root = TreeNode(in_lan=teacher.membership_query(tuple()))
-        self._leafs = [self._root]
+        self._words = WordTrie()
+        self._tree = DiscriminationTree(teacher.membership_query(tuple()))
+        self._leafs = [DiscriminationTree.ROOT]
+        # word -> the node it was last sifted to. The tree only grows under leafs, so if that node was split since,
+        # the word is sifted on from it rather than from the root.
+        self._sift_cache = {}
         self.dfa = self._produce_hypothesis()
-        self.prev_examples = {}
+
+    def _membership_query(self, word_id):
+        return self.teacher.membership_query(self._words.word(word_id))
+
+    def _membership_query_set(self, word_ids):
+        return self.teacher.membership_queries([self._words.word(word_id) for word_id in word_ids])
 
     def _sift(self, word):
-        current_node = self._root
-        while True:
-            if current_node in self._leafs:
-                return current_node
-
-            if self.prev_examples.setdefault(word + current_node.name,
-                                             self.teacher.membership_query(word + current_node.name)):
-            # if self.teacher.membership_query(word + current_node.name):
-                current_node = current_node.right
+        tree = self._tree
+        current_node = self._sift_cache.get(word, DiscriminationTree.ROOT)
+        while tree.left[current_node] >= 0:
+            if self._membership_query(self._words.concat(word, tree.name_id[current_node])):
+                current_node = tree.right[current_node]
             else:
-                current_node = current_node.left
+                current_node = tree.left[current_node]
+        self._sift_cache[word] = current_node
+        return current_node
 
     def _produce_hypothesis(self):
-        transitions = {}
-        final_nodes = []
+        self._leaf_transitions = {}
         for leaf in self._leafs:
-            if leaf.inLan:
-                final_nodes.append(leaf.name)
             tran = {}
             for l in self.teacher.alphabet:
-                state = self._sift(leaf.name + tuple([l]))
-                tran.update({l: state.name})
-            transitions.update({leaf.name: tran})
+                tran.update({l: self._sift(self._words.extend(self._tree.name_id[leaf], l))})
+            self._leaf_transitions.update({leaf: tran})
 
-        return DFA(tuple(""), tuple(final_nodes), transitions)
+        return self._hypothesis_from_leaf_transitions()
 
-    def _sift_set(self, words: []):
+    def _hypothesis_from_leaf_transitions(self):
         """
-        Like regular sift but done for a batches of words.
-        This is a speeding up for RNN learning.
+        The hypothesis DFA of the transitions between the leafs kept in self._leaf_transitions.
         """
-        words_left = len(words)
-        current_nodes = [[self._root, i] for i in range(words_left)]
-        final = [None for _ in words]
-        while True:
-            answers = self.teacher.model.is_words_in_batch([words[x[1]] + x[0].name for x in current_nodes])
-            if len(answers.shape) == 0:
-                if answers > 0.5:
-                    current_nodes[0][0] = current_nodes[0][0].right
-                else:
-                    current_nodes[0][0] = current_nodes[0][0].left
+        names = self._tree.names
+        transitions = {names[leaf]: {letter: names[target] for letter, target in tran.items()}
+                       for leaf, tran in self._leaf_transitions.items()}
+        final_nodes = [names[leaf] for leaf in self._leafs if self._tree.in_lan[leaf]]
+        return DFA(tuple(""), final_nodes, transitions)
 
-                if current_nodes[0][0] in self._leafs:
-                    final[current_nodes[0][1]] = current_nodes[0][0]
-                    del (current_nodes[0])
-                    words_left = words_left - 1
-            else:
-                for i in range(len(answers) - 1, -1, -1):
-                    if answers[i] > 0.5:
-                        current_nodes[i][0] = current_nodes[i][0].right
-                    else:
-                        current_nodes[i][0] = current_nodes[i][0].left
-
-                    if current_nodes[i][0] in self._leafs:
-                        final[current_nodes[i][1]] = current_nodes[i][0]
-                        del (current_nodes[i])
-                        words_left = words_left - 1
-            if words_left == 0:
-                return final
-
-    def _produce_hypothesis_set(self):
+    def _update_hypothesis(self, split_node, old_leaf, new_leaf, do_hypothesis_in_batches=False):
         """
-            Like regular produce_hypothesis but done for a batches of words.
-            This is a speeding up for RNN learning.
+        Updates the hypothesis after the leaf split_node was split into old_leaf (with the same access string) and
+        new_leaf. Sifting is not affected outside the subtree of split_node, so only the transitions that led to
+        split_node are sifted again (on from it, by the sift cache) and only the transitions of new_leaf are sifted
+        from the root.
         """
-        transitions = {}
-        final_nodes = []
-        leafs_plus_letters = []
-        for leaf in self._leafs:
-            if leaf.inLan:
-                final_nodes.append(leaf.name)
-            for letter in self.teacher.alphabet:
-                leafs_plus_letters.append(leaf.name + tuple([letter]))
-        states = self._sift_set(leafs_plus_letters)
-        for leaf in range(len(self._leafs)):
-            transition = {}
-            for letter in range(len(self.teacher.alphabet)):
-                transition.update(
-                    {self.teacher.alphabet[letter]: states[leaf * len(self.teacher.alphabet) + letter].name})
-            transitions.update({self._leafs[leaf].name: transition})
+        self._leaf_transitions[old_leaf] = self._leaf_transitions.pop(split_node)
+        to_sift = [(leaf, letter) for leaf, tran in self._leaf_transitions.items()
+                   for letter, target in tran.items() if target == split_node]
+        to_sift.extend([(new_leaf, letter) for letter in self.teacher.alphabet])
+        words = [self._words.extend(self._tree.name_id[leaf], letter) for leaf, letter in to_sift]
+
+        if do_hypothesis_in_batches:
+            states = self._sift_set(words)
+        else:
+            states = [self._sift(word) for word in words]
 
-        return DFA(tuple(""), final_nodes, transitions)
+        self._leaf_transitions[new_leaf] = {}
+        for (leaf, letter), state in zip(to_sift, states):
+            self._leaf_transitions[leaf][letter] = state
+        # keeping the letters of new_leaf in the order of the alphabet
+        self._leaf_transitions[new_leaf] = {letter: self._leaf_transitions[new_leaf][letter]
+                                            for letter in self.teacher.alphabet}
+        return self._hypothesis_from_leaf_transitions()
+
+    def _sift_set(self, words: []):
+        """
+        Like regular sift but done for a batches of words.
+        This is a speeding up for RNN learning: the words go down the tree a level at a time and the queries of a
+        level are asked together, only the ones never asked before (in this batch or earlier) reach the model.
+        """
+        tree = self._tree
+        left, right = DiscriminationTree.view(tree.left), DiscriminationTree.view(tree.right)
+        name_id = DiscriminationTree.view(tree.name_id)
+        words = np.asarray(words, dtype=np.int64)
+        nodes = np.fromiter((self._sift_cache.get(word, DiscriminationTree.ROOT) for word in words.tolist()),
+                            dtype=np.int64, count=len(words))
+        frontier = np.flatnonzero(left[nodes] >= 0)
+        while len(frontier) != 0:
+            frontier_nodes = nodes[frontier]
+            answers = self._membership_query_set(
+                [self._words.concat(word, discriminator)
+                 for word, discriminator in zip(words[frontier].tolist(), name_id[frontier_nodes].tolist())])
+            nodes[frontier] = np.where(answers, right[frontier_nodes], left[frontier_nodes])
+            frontier = frontier[left[nodes[frontier]] >= 0]
+
+        nodes = nodes.tolist()
+        self._sift_cache.update(zip(words.tolist(), nodes))
+        return nodes
+
+    def _binary_search_breakpoint(self, word, in_batches=False, points_per_batch=16):
+        """
+        With u_i the access string of the state the hypothesis reaches on word[:i], alpha(i) = MQ(u_i + word[i:])
+        is MQ(word) for i = 0 and the answer of the hypothesis for i = len(word), which differ on a counterexample.
+        A binary search finds i with alpha(i) != alpha(i + 1), then u_i + word[i] is a new state, told apart from
+        u_(i + 1) (the state the hypothesis goes to from u_i on word[i]) by word[i + 1:].
+        The queries on the suffixes of word are long and asked once, so they are not interned.
+        With in_batches, the search is over points_per_batch points at a time, asked from the model in one batch.
+        Returns the ids of the new state and of the discriminator.
+        """
+        word = tuple(word)
+        access_strings = [self.dfa.init_state]
+        for letter in word:
+            access_strings.append(self.dfa.next_state_by_letter(access_strings[-1], letter))
+
+        low, high = 0, len(word)
+        if in_batches:
+            alpha_low = self.teacher.membership_queries([word])[0]
+            while high - low > 1:
+                step = max((high - low) // (points_per_batch + 1), 1)
+                points = list(range(low + step, high, step))[:points_per_batch]
+                answers = self.teacher.membership_queries([access_strings[i] + word[i:] for i in points])
+                for i, answer in zip(points, answers):
+                    if answer != alpha_low:
+                        high = i
+                        break
+                    low = i
+        else:
+            alpha_low = self.teacher.membership_query(word)
+            while high - low > 1:
+                middle = (low + high) // 2
+                if self.teacher.membership_query(access_strings[middle] + word[middle:]) == alpha_low:
+                    low = middle
+                else:
+                    high = middle
+        leaf_ids = {self._tree.names[leaf]: self._tree.name_id[leaf] for leaf in self._leafs}
+        return (self._words.extend(leaf_ids[access_strings[low]], word[low]),
+                self._words.intern(islice(word, low + 1, None)))
 
     def new_counterexample(self, word, do_hypothesis_in_batches=False,max_refinements=20):
         val = self.dfa.is_word_in(word)
@@ -197,43 +276,62 @@ class DecisionTreeLearner(Learner):
 
             if len(self._leafs) == 1:
                 first_time = True
-                new_differencing_string = self._leafs[0].name
-                new_state_string = word
+                new_differencing_string = self._tree.name_id[self._leafs[0]]
+                new_state_string = self._words.intern(word)
+
+            elif self.counterexample_analysis == "binary":
+                new_state_string, new_differencing_string = self._binary_search_breakpoint(word, do_hypothesis_in_batches)
 
             else:
+                if do_hypothesis_in_batches:
+                    # all the prefixes are sifted together, a batch for each level of the tree
+                    prefixes = [WordTrie.EMPTY]
+                    for letter in word:
+                        prefixes.append(self._words.extend(prefixes[-1], letter))
+                    states_tree = iter(self._sift_set(prefixes[1:]))
                 state_dfa = self.dfa.init_state
-                prefix = tuple()
+                prefix = WordTrie.EMPTY
                 for letter in word:
-                    prefix = prefix + tuple([letter])
-                    state_tree = self._sift(prefix)
+                    new_state_string = prefix
+                    prefix = self._words.extend(prefix, letter)
+                    state_tree = next(states_tree) if do_hypothesis_in_batches else self._sift(prefix)
                     state_dfa = self.dfa.next_state_by_letter(state_dfa, letter)
-                    if state_tree.name != state_dfa:
+                    if self._tree.names[state_tree] != state_dfa:
                         for state_tree_2 in self._leafs:
-                            if state_tree_2.name == state_dfa:
+                            if self._tree.names[state_tree_2] == state_dfa:
                                 break
-                        state_tree = finding_common_ancestor(state_tree, state_tree_2)
-                        new_differencing_string = tuple([letter]) + state_tree.name
+                        state_tree = self._tree.common_ancestor(state_tree, state_tree_2)
+                        new_differencing_string = self._words.concat(self._words.extend(WordTrie.EMPTY, letter),
+                                                                     self._tree.name_id[state_tree])
                         break
 
-                new_state_string = prefix[0:len(prefix) - 1]
-
-            node_to_replace = self._sift(new_state_string)
-
-            if self.teacher.membership_query(node_to_replace.name + new_differencing_string):
-                node_to_replace.left = TreeNode(new_state_string, first_time ^ node_to_replace.inLan, node_to_replace)
-                node_to_replace.right = TreeNode(node_to_replace.name, node_to_replace.inLan, node_to_replace)
+            if do_hypothesis_in_batches:
+                node_to_replace = self._sift_set([new_state_string])[0]
+            else:
+                node_to_replace = self._sift(new_state_string)
+
+            tree = self._tree
+            in_lan = bool(tree.in_lan[node_to_replace])
+            new_leaf = tree.add_node(node_to_replace, self._words.word(new_state_string, keep=True),
+                                     new_state_string, first_time ^ in_lan)
+            old_leaf = tree.add_node(node_to_replace, tree.names[node_to_replace],
+                                     tree.name_id[node_to_replace], in_lan)
+            split_query = self._words.concat(tree.name_id[node_to_replace], new_differencing_string)
+            if do_hypothesis_in_batches:
+                split_answer = self._membership_query_set([split_query])[0]
             else:
-                node_to_replace.right = TreeNode(new_state_string, first_time ^ node_to_replace.inLan, node_to_replace)
-                node_to_replace.left = TreeNode(node_to_replace.name, node_to_replace.inLan, node_to_replace)
+                split_answer = self._membership_query(split_query)
+            if split_answer:
+                tree.left[node_to_replace], tree.right[node_to_replace] = new_leaf, old_leaf
+            else:
+                tree.right[node_to_replace], tree.left[node_to_replace] = new_leaf, old_leaf
 
             self._leafs.remove(node_to_replace)
-            node_to_replace.name = new_differencing_string
-            self._leafs.extend([node_to_replace.right, node_to_replace.left])
+            tree.set_name(node_to_replace, self._words.word(new_differencing_string, keep=True),
+                          new_differencing_string)
+            self._leafs.extend([tree.right[node_to_replace], tree.left[node_to_replace]])
 
-            if do_hypothesis_in_batches:
-                self.dfa = self._produce_hypothesis_set()
-            else:
-                self.dfa = self._produce_hypothesis()
+            self.dfa = self._update_hypothesis(node_to_replace, old_leaf, new_leaf, do_hypothesis_in_batches)
         if numb_of_refinements > 1:
             print("num of ref: {}".format(numb_of_refinements))
         return numb_of_refinements
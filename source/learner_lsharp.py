@@ -0,0 +1,218 @@
+from dfa import DFA
+from learner import Learner
+
+
+class ObservationTreeNode:
+    """
+    A node of the observation tree of LSharpLearner, the word from the root to it and the answer of the membership
+    query on that word (None if it was never asked, the node is only on the way to longer words).
+    """
+
+    def __init__(self, word, parent=None):
+        self.word = word
+        self.parent = parent
+        self.children = {}
+        self.accepting = None
+
+
+def _differs(node, accepting):
+    return node is not None and node.accepting is not None and node.accepting != accepting
+
+
+class LSharpLearner(Learner):
+    """
+    Implementation of the DFA learner from:
+      Frits Vaandrager, Bharat Garhewal, Jurriaan Rot, Thorsten Wißmann - A New Approach for Active Automata
+      Learning Based on Apartness
+
+    The learner keeps an observation tree of the words actually asked. Two words are apart if some suffix gives
+    them different answers in the tree. The basis is a set of pairwise apart words (the states of the hypothesis)
+    and the frontier is their one letter extensions, each with the basis words it is not apart from. The rules
+    promote a frontier word apart from the whole basis, extend the basis words by every letter and ask the
+    frontier words the suffix that tells two of their candidates apart, until every frontier word has a single
+    candidate and the hypothesis can be built. A word is never asked twice.
+    """
+
+    def __init__(self, teacher):
+        self.teacher = teacher
+        self._root = ObservationTreeNode(tuple())
+        self._basis = [self._root]
+        self._basis_nodes = {self._root}
+        self._frontier = {}
+
+        self._membership_queries([tuple()])
+        self._stabilize()
+        self.dfa = self._produce_hypothesis()
+
+    def _node(self, word):
+        node = self._root
+        for letter in word:
+            child = node.children.get(letter)
+            if child is None:
+                child = ObservationTreeNode(node.word + tuple([letter]), node)
+                node.children[letter] = child
+            node = child
+        return node
+
+    def _lookup(self, node, suffix):
+        for letter in suffix:
+            node = node.children.get(letter)
+            if node is None:
+                return None
+        return node
+
+    def _membership_queries(self, words, in_batches=False):
+        """
+        Adds the answers to the membership queries of words to the tree, asking the teacher only about the words
+        the tree has no answer for (all together in a batch of the model if in_batches).
+        """
+        nodes = [self._node(word) for word in words]
+        to_ask = [node for node in dict.fromkeys(nodes) if node.accepting is None]
+        if in_batches and len(to_ask) != 0:
+            answers = self.teacher.membership_queries([node.word for node in to_ask])
+        else:
+            answers = [self.teacher.membership_query(node.word) for node in to_ask]
+        for node, answer in zip(to_ask, answers):
+            node.accepting = answer
+            self._update_apartness(node)
+        return [node.accepting for node in nodes]
+
+    def _update_apartness(self, node):
+        """
+        Drops the candidates that the new answer on node tells apart from their frontier words. A new witness
+        has node as one of its two ends, so only the frontier and basis words on the way to node are checked.
+        """
+        suffix = []
+        ancestor = node
+        while ancestor is not None:
+            witness = tuple(reversed(suffix))
+            if ancestor in self._frontier:
+                self._frontier[ancestor] = [q for q in self._frontier[ancestor]
+                                            if not _differs(self._lookup(q, witness), node.accepting)]
+            elif ancestor in self._basis_nodes:
+                for frontier, candidates in self._frontier.items():
+                    if ancestor in candidates and _differs(self._lookup(frontier, witness), node.accepting):
+                        candidates.remove(ancestor)
+            if ancestor.parent is not None:
+                suffix.append(ancestor.word[-1])
+            ancestor = ancestor.parent
+
+    def _apartness_witness(self, node1, node2):
+        """
+        A suffix with different answers after the words of node1 and node2 in the tree, None if they are not apart.
+        """
+        to_check = [(node1, node2, tuple())]
+        while len(to_check) != 0:
+            node1, node2, suffix = to_check.pop()
+            if node1.accepting is not None and _differs(node2, node1.accepting):
+                return suffix
+            for letter, child in node1.children.items():
+                if letter in node2.children:
+                    to_check.append((child, node2.children[letter], suffix + tuple([letter])))
+        return None
+
+    def _extend(self, in_batches=False):
+        """
+        Asks every one letter extension of the basis and adds the new ones to the frontier.
+        """
+        extensions = [q.word + tuple([letter]) for q in self._basis for letter in self.teacher.alphabet
+                      if letter not in q.children or q.children[letter].accepting is None]
+        self._membership_queries(extensions, in_batches)
+        for q in self._basis:
+            for child in q.children.values():
+                if child not in self._frontier and child not in self._basis_nodes:
+                    self._frontier[child] = [p for p in self._basis if self._apartness_witness(child, p) is None]
+
+    def _stabilize(self, in_batches=False):
+        """
+        Applies the promotion, extension and separation rules until every frontier word is identified with a
+        single basis word.
+        """
+        while True:
+            self._extend(in_batches)
+
+            promoted = [node for node, candidates in self._frontier.items() if len(candidates) == 0]
+            if len(promoted) != 0:
+                node = min(promoted, key=lambda n: len(n.word))
+                del self._frontier[node]
+                for frontier, candidates in self._frontier.items():
+                    if self._apartness_witness(frontier, node) is None:
+                        candidates.append(node)
+                self._basis.append(node)
+                self._basis_nodes.add(node)
+                continue
+
+            separations = []
+            for node, candidates in self._frontier.items():
+                if len(candidates) > 1:
+                    separations.append(node.word + self._apartness_witness(candidates[0], candidates[1]))
+            if len(separations) == 0:
+                return
+            self._membership_queries(separations, in_batches)
+
+    def _hypothesis_state(self, node):
+        return node if node in self._basis_nodes else self._frontier[node][0]
+
+    def _produce_hypothesis(self):
+        transitions = {q.word: {letter: self._hypothesis_state(q.children[letter]).word
+                                for letter in self.teacher.alphabet}
+                       for q in self._basis}
+        final_states = [q.word for q in self._basis if q.accepting]
+        return DFA(tuple(), final_states, transitions)
+
+    def _process_counterexample(self, word):
+        """
+        Makes a frontier word apart from the basis word it is identified with. With h_i the basis word of the
+        hypothesis state of word[:i], the answer on h_i + word[i:] equals the answer on word for the first
+        frontier prefix of word (or that prefix is already apart by the rest of word) and differs from it at
+        i = len(word). A binary search finds i where it changes, then h_i + word[i] is a frontier word that
+        word[i + 1:] tells apart from h_(i + 1).
+        """
+        # the states are taken from self.dfa, the answers below may already change the frontier candidates
+        answer = self._membership_queries([word])[0]
+        states = [self.dfa.init_state]
+        first_frontier = None
+        for i, letter in enumerate(word):
+            states.append(self.dfa.transitions[states[-1]][letter])
+            if first_frontier is None and states[-1] != word[:i + 1]:
+                first_frontier = i + 1
+
+        low, high = first_frontier, len(word)
+        if self._membership_queries([states[low] + word[low:]])[0] != answer:
+            return
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self._membership_queries([states[middle] + word[middle:]])[0] == answer:
+                low = middle
+            else:
+                high = middle
+
+    def _tree_counterexample(self):
+        """
+        A word of the tree that the hypothesis gets wrong, found without any membership query.
+        """
+        to_check = [(self._root, self._root)]
+        while len(to_check) != 0:
+            node, state = to_check.pop()
+            if node.accepting is not None and node.accepting != state.accepting:
+                return node.word
+            for letter, child in node.children.items():
+                to_check.append((child, self._hypothesis_state(state.children[letter])))
+        return None
+
+    def new_counterexample(self, word, do_hypothesis_in_batches=False, max_refinements=20):
+        word = tuple(word)
+        if self._membership_queries([word])[0] == self.dfa.is_word_in(word):
+            return 1
+        numb_of_refinements = 1
+        while word is not None:
+            if numb_of_refinements > max_refinements:
+                print("num of ref: {}".format(numb_of_refinements))
+                return numb_of_refinements
+            numb_of_refinements += 1
+
+            self._process_counterexample(word)
+            self._stabilize(do_hypothesis_in_batches)
+            self.dfa = self._produce_hypothesis()
+            word = self._tree_counterexample()
+        return numb_of_refinements
@@ -0,0 +1,320 @@
+from dfa import DFA
+from learner import Learner
+
+
+class TTTNode:
+    """
+    A node of the discrimination tree of TTTLearner. An inner node has a discriminator (a suffix) and its children
+    by the answer to the membership query of access word + discriminator. A leaf holds a state of the hypothesis and
+    the non tree transitions that lead to it.
+    The discriminators of final nodes are short (a letter followed by a final discriminator), the temporary ones
+    come from counterexamples and are replaced as soon as possible.
+    """
+
+    def __init__(self, parent=None, outcome=None):
+        self.parent = parent
+        self.outcome = outcome
+        self.discriminator = None
+        self.final = False
+        self.children = {}
+        self.state = None
+        self.incoming = set()
+
+    @property
+    def is_leaf(self):
+        return self.discriminator is None
+
+
+class TTTState:
+    """
+    A state of the hypothesis, its access word is the word of the spanning tree from the initial state.
+    """
+
+    def __init__(self, access, accepting, leaf):
+        self.access = access
+        self.accepting = accepting
+        self.leaf = leaf
+        leaf.state = self
+        self.transitions = {}
+
+
+class TTTTransition:
+    """
+    A transition of the hypothesis. A tree transition leads to the state it is the access word of, any other
+    transition points at a node of the discrimination tree, it is open until it is sifted down to a leaf.
+    """
+
+    def __init__(self, source, letter, node):
+        self.source = source
+        self.letter = letter
+        self.node = node
+        self.tree_target = None
+        self.word = source.access + tuple([letter])
+
+    def target(self) -> TTTState:
+        if self.tree_target is not None:
+            return self.tree_target
+        return self.node.state
+
+
+def _lowest_common_ancestor(nodes):
+    ancestors = []
+    node = nodes[0]
+    while node is not None:
+        ancestors.append(node)
+        node = node.parent
+    height = {node: i for i, node in enumerate(ancestors)}
+
+    lowest = 0
+    for node in nodes[1:]:
+        while node not in height:
+            node = node.parent
+        lowest = max(lowest, height[node])
+    return ancestors[lowest]
+
+
+def _restrict(node, leafs):
+    """
+    The subtree of node with only the given leafs, inner nodes left with a single child are skipped.
+    """
+    if node.is_leaf:
+        return node if node in leafs else None
+    children = {outcome: _restrict(child, leafs) for outcome, child in node.children.items()}
+    children = {outcome: child for outcome, child in children.items() if child is not None}
+    if len(children) == 0:
+        return None
+    if len(children) == 1:
+        return next(iter(children.values()))
+
+    restricted = TTTNode()
+    restricted.discriminator, restricted.final = node.discriminator, node.final
+    for outcome, child in children.items():
+        child.parent, child.outcome = restricted, outcome
+        restricted.children[outcome] = child
+    return restricted
+
+
+class TTTLearner(Learner):
+    """
+    Implementation of the DFA learner from:
+      Malte Isberner, Falk Howar, Bernhard Steffen - The TTT Algorithm: A Redundancy-Free Approach to Active
+      Automata Learning
+
+    Like DecisionTreeLearner it keeps a discrimination tree, but the hypothesis states are reached by a spanning
+    tree (every access word is the access word of another state plus a letter) and counterexamples are only used
+    to split a state by a temporary discriminator (found by Rivest and Schapire's binary search). Temporary
+    discriminators are then replaced by final ones, a letter followed by an existing final discriminator, so the
+    membership queries stay short however long the counterexamples are.
+    """
+
+    def __init__(self, teacher):
+        self.teacher = teacher
+        self._root = TTTNode()
+        self._root.discriminator = tuple()
+        self._root.final = True
+        self._states = []
+        self._open = []
+
+        accepting = self._membership_queries([tuple()])[0]
+        leaf = TTTNode(self._root, accepting)
+        self._root.children[accepting] = leaf
+        self._initial = self._add_state(tuple(), accepting, leaf)
+        self._close()
+        self.dfa = self._produce_hypothesis()
+
+    def _membership_queries(self, words, in_batches=False):
+        """
+        The answers to the membership queries of words, all together in a batch of the model if in_batches. The
+        words asked before are answered by the oracle of the teacher.
+        """
+        if in_batches:
+            return self.teacher.membership_queries(words)
+        return [self.teacher.membership_query(word) for word in words]
+
+    def _add_state(self, access, accepting, leaf, tree_transition=None):
+        state = TTTState(access, accepting, leaf)
+        if tree_transition is not None:
+            tree_transition.tree_target = state
+            tree_transition.node = None
+        for letter in self.teacher.alphabet:
+            transition = TTTTransition(state, letter, self._root)
+            state.transitions[letter] = transition
+            self._open.append(transition)
+        self._states.append(state)
+        return state
+
+    def _close(self, in_batches=False):
+        """
+        Sifts all the open transitions down to leafs, a level at a time. A transition that reaches a missing child
+        (only possible under the root) becomes the tree transition of a new state.
+        """
+        while len(self._open) != 0:
+            to_sift, self._open = self._open, []
+            answers = self._membership_queries([t.word + t.node.discriminator for t in to_sift], in_batches)
+            for transition, answer in zip(to_sift, answers):
+                child = transition.node.children.get(answer)
+                if child is None:
+                    leaf = TTTNode(transition.node, answer)
+                    transition.node.children[answer] = leaf
+                    self._add_state(transition.word, answer, leaf, transition)
+                    continue
+                transition.node = child
+                if child.is_leaf:
+                    child.incoming.add(transition)
+                else:
+                    self._open.append(transition)
+
+    def _decompose(self, word):
+        """
+        Rivest and Schapire's counterexample analysis: with u_i the access word of the state the hypothesis reaches
+        on word[:i], MQ(u_i + word[i:]) differs between i = 0 and i = len(word), a binary search finds i where it
+        changes. Then the transition from u_i on word[i] leads to a state that word[i + 1:] tells apart from its
+        access word.
+        Returns the transition, the suffix and the answer on u_i + word[i:], None if word is no counterexample.
+        """
+        states = [self._initial]
+        for letter in word:
+            states.append(states[-1].transitions[letter].target())
+
+        low, high = 0, len(word)
+        alpha_low = self._membership_queries([word])[0]
+        if alpha_low == states[-1].accepting:
+            return None
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self._membership_queries([states[middle].access + word[middle:]])[0] == alpha_low:
+                low = middle
+            else:
+                high = middle
+        return states[low].transitions[word[low]], word[low + 1:], alpha_low
+
+    def _split(self, transition, suffix, new_outcome):
+        """
+        Makes transition the tree transition of a new state, splitting the leaf of the state it led to by the
+        temporary discriminator suffix.
+        """
+        old_state = transition.target()
+        node = old_state.leaf
+        node.incoming.discard(transition)
+        incoming, node.incoming = node.incoming, set()
+        node.state = None
+        node.discriminator = suffix
+        node.final = False
+
+        old_leaf = TTTNode(node, not new_outcome)
+        old_leaf.state, old_state.leaf = old_state, old_leaf
+        new_leaf = TTTNode(node, new_outcome)
+        node.children = {not new_outcome: old_leaf, new_outcome: new_leaf}
+        self._add_state(transition.word, old_state.accepting, new_leaf, transition)
+
+        for t in incoming:
+            t.node = node
+            self._open.append(t)
+
+    def _block_roots(self):
+        """
+        The temporary nodes right under final ones, each is the root of a block of states that are only told
+        apart by temporary discriminators.
+        """
+        roots = []
+        to_check = [self._root]
+        while len(to_check) != 0:
+            node = to_check.pop()
+            for child in node.children.values():
+                if child.is_leaf:
+                    continue
+                if child.final:
+                    to_check.append(child)
+                else:
+                    roots.append(child)
+        return roots
+
+    def _leafs_under(self, node):
+        leafs = []
+        to_check = [node]
+        while len(to_check) != 0:
+            node = to_check.pop()
+            if node.is_leaf:
+                leafs.append(node)
+            else:
+                to_check.extend(node.children.values())
+        return leafs
+
+    def _finalize_discriminators(self, in_batches=False):
+        """
+        Replaces the discriminators at the roots of blocks by final ones while possible. A block can get the final
+        discriminator letter + v if the transitions of its states on letter lead to different sides of the final
+        node of v, the shortest such discriminator is taken first.
+        """
+        while True:
+            best = None
+            for block_root in self._block_roots():
+                states = [leaf.state for leaf in self._leafs_under(block_root)]
+                for letter in self.teacher.alphabet:
+                    lca = _lowest_common_ancestor([q.transitions[letter].target().leaf for q in states])
+                    if lca.is_leaf or not lca.final:
+                        continue
+                    discriminator = tuple([letter]) + lca.discriminator
+                    if best is None or len(discriminator) < len(best[1]):
+                        best = (block_root, discriminator, letter, lca, states)
+            if best is None:
+                return
+            self._replace_discriminator(*best)
+            self._close(in_batches)
+
+    def _replace_discriminator(self, block_root, discriminator, letter, lca, states):
+        # The answer of access + letter + lca.discriminator is known for every state from the side of lca its
+        # transition on letter leads to.
+        sides = {}
+        for state in states:
+            node = state.transitions[letter].target().leaf
+            while node.parent is not lca:
+                node = node.parent
+            sides[state] = node.outcome
+
+        # The answers of the non tree transitions into the block on the new discriminator are not known, they are
+        # sifted again from the block root.
+        incoming = set()
+        for state in states:
+            incoming.update(state.leaf.incoming)
+            state.leaf.incoming = set()
+
+        old_block = TTTNode()
+        old_block.discriminator, old_block.children = block_root.discriminator, block_root.children
+        block_root.discriminator = discriminator
+        block_root.final = True
+        block_root.children = {}
+        for outcome in [False, True]:
+            child = _restrict(old_block, {state.leaf for state in states if sides[state] == outcome})
+            child.parent, child.outcome = block_root, outcome
+            block_root.children[outcome] = child
+
+        for t in incoming:
+            t.node = block_root
+            self._open.append(t)
+
+    def _produce_hypothesis(self):
+        transitions = {state.access: {letter: state.transitions[letter].target().access
+                                      for letter in self.teacher.alphabet}
+                       for state in self._states}
+        final_states = [state.access for state in self._states if state.accepting]
+        return DFA(tuple(), final_states, transitions)
+
+    def new_counterexample(self, word, do_hypothesis_in_batches=False, max_refinements=20):
+        word = tuple(word)
+        val = self.dfa.is_word_in(word)
+        numb_of_refinements = 1
+        while self.dfa.is_word_in(word) == val:
+            if numb_of_refinements > max_refinements:
+                print("num of ref: {}".format(numb_of_refinements))
+                return numb_of_refinements
+            decomposition = self._decompose(word)
+            if decomposition is None:
+                return numb_of_refinements
+            numb_of_refinements += 1
+
+            self._split(*decomposition)
+            self._close(do_hypothesis_in_batches)
+            self._finalize_discriminators(do_hypothesis_in_batches)
+            self.dfa = self._produce_hypothesis()
+        return numb_of_refinements
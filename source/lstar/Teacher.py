@@ -1,6 +1,7 @@
 from lstar.Quantisations import SVMDecisionTreeQuantisation
 from lstar.WhiteboxRNNCounterexampleGenerator import WhiteboxRNNCounterexampleGenerator
 from time import clock
+from membership_oracle import shared_oracle
 
 class Teacher:
     def __init__(self, network, num_dims_initial_split=10,starting_examples=None):
@@ -13,12 +14,13 @@ class Teacher:
         self.counterexamples_with_times = []
         self.current_ce_count = 0
         self.network = network
+        self.oracle = shared_oracle(network) # the answers are shared with any other teacher or learner of the network
         self.alphabet = network.alphabet #this is more for intuitive use by lstar (it doesn't need to know there's a network involved)
 
     def update_words(self,words):
         seen = set(self.recorded_words.keys())
         words = set(words) - seen #need this to avoid answering same thing twice, which may happen a lot now with optimistic querying...
-        self.recorded_words.update({w:self.network.classify_word(w) for w in words})
+        self.recorded_words.update({w:self.oracle.is_word_in(w) for w in words})
 
     def classify_word(self, w):
         return self.network.classify_word(w)
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import pickle
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+
+def model_hash(model):
+    """
+    A hex digest that identifies what the model computes: the canonical form of a DFA or the state_dict of a network
+    (of model._rnn for RNNLanguageClasifier, of the float network it was made from for a quantized copy), together
+    with the alphabet. None for any other model.
+    """
+    digest = hashlib.sha1(repr(tuple(model.alphabet)).encode())
+    if hasattr(model, "canonical_form"):
+        letters, transitions, final = model.canonical_form()
+        digest.update(repr(letters).encode())
+        digest.update(transitions)
+        digest.update(final)
+        return digest.hexdigest()
+
+    network = getattr(model, "_rnn", model)
+    if getattr(model, "quantized", False):
+        digest.update(b"qint8")
+        network = model._float_rnn
+    if not hasattr(network, "state_dict"):
+        return None
+    for name, tensor in network.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+class MembershipOracle:
+    """
+    Answers membership queries on a model, remembering the answers of the last max_size words asked (least recently
+    used first out). Words are keyed by their tuple, whatever sequence they are given as.
+    With a cache_dir the answers are kept on disk between runs in a file named by model_hash, so they are only
+    reused by a model that computes the same function. Nothing is written before save() is called.
+    """
+
+    def __init__(self, model, max_size=2 ** 20, cache_dir=None):
+        self.model = model
+        self.alphabet = model.alphabet
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._answers = OrderedDict()
+
+        self._path = None
+        if cache_dir is not None:
+            key = model_hash(model)
+            if key is not None:
+                self._path = os.path.join(cache_dir, "membership_{}.pkl".format(key))
+                if os.path.exists(self._path):
+                    with open(self._path, "rb") as file:
+                        for word, answer in pickle.load(file):
+                            self._store(word, answer)
+
+    def __len__(self):
+        return len(self._answers)
+
+    def __contains__(self, word):
+        return tuple(word) in self._answers
+
+    def _store(self, word, answer):
+        self._answers[word] = answer
+        if len(self._answers) > self.max_size:
+            self._answers.popitem(last=False)
+
+    def is_word_in(self, word):
+        word = tuple(word)
+        answer = self._answers.get(word)
+        if answer is not None:
+            self.hits += 1
+            self._answers.move_to_end(word)
+            return answer
+        self.misses += 1
+        answer = bool(self.model.is_word_in(word))
+        self._store(word, answer)
+        return answer
+
+    def is_words_in_batch(self, words):
+        """
+        The answers on words as a bool array, the words without a remembered answer are asked from the model in a
+        single batch, each of them once.
+        """
+        words = [tuple(word) for word in words]
+        answers = {}
+        to_ask = []
+        for word in dict.fromkeys(words):
+            answer = self._answers.get(word)
+            if answer is None:
+                to_ask.append(word)
+            else:
+                answers[word] = answer
+                self._answers.move_to_end(word)
+        self.misses += len(to_ask)
+        self.hits += len(words) - len(to_ask)
+
+        if len(to_ask) != 0:
+            new_answers = np.asarray(self.model.is_words_in_batch(to_ask) > 0.5).reshape(-1).tolist()
+            for word, answer in zip(to_ask, new_answers):
+                answers[word] = answer
+                self._store(word, answer)
+        return np.array([answers[word] for word in words], dtype=bool)
+
+    def clear(self):
+        self._answers.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def save(self):
+        """
+        Writes the remembered answers to the cache_dir given to the constructor, if any.
+        """
+        if self._path is None:
+            return
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with open(self._path, "wb") as file:
+            pickle.dump(list(self._answers.items()), file)
+
+
+_oracles = weakref.WeakValueDictionary()
+
+
+def shared_oracle(model, max_size=2 ** 20, cache_dir=None):
+    """
+    The MembershipOracle of model, the same one for every teacher and learner as long as one of them holds it.
+    max_size and cache_dir are only used when it is created.
+    """
+    oracle = _oracles.get(id(model))
+    if oracle is None or oracle.model is not model:
+        oracle = MembershipOracle(model, max_size, cache_dir)
+        _oracles[id(model)] = oracle
+    return oracle
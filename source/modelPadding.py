@@ -1,11 +1,15 @@
 import os
 import time
+import warnings
+from collections import OrderedDict, namedtuple
 from copy import copy
+from functools import lru_cache
+from typing import List
 
 import numpy as np
 import torch
 import torch.nn as nn
-from torch.nn.utils.rnn import pad_sequence, pack_padded_sequence, pad_packed_sequence
+from torch.nn.utils.rnn import PackedSequence, pad_sequence, pack_padded_sequence, pad_packed_sequence
 from torch.utils.data import DataLoader
 from torch.utils.data import Dataset
 
@@ -376,9 +380,152 @@ class LSTM(nn.Module):
                   torch.zeros(self.n_layers, batch_size, self.hidden_dim).to(self.device))
         return hidden
 
+    def forward_trie(self, levels, terminals):
+        """
+        Runs the network over a prefix trie (see prefix_trie_levels) a level at a time, each node from the hidden
+        state of its parent, so a prefix shared by several words is computed once.
+        Returns the output at the terminal node of every word.
+        """
+        hidden = self.init_hidden(1)
+        outputs = torch.empty(len(terminals), device=self.device)
+        ends = [([], []) for _ in levels]
+        for i, (level, node) in enumerate(terminals):
+            ends[level][0].append(i)
+            ends[level][1].append(node)
+
+        for (parents, letters), (words, nodes) in zip(levels, ends):
+            parents = torch.from_numpy(parents).to(self.device)
+            x_embed = self.embedding(torch.from_numpy(letters).to(self.device).view(-1, 1))
+            out_ltsm, hidden = self.lstm(x_embed, (hidden[0][:, parents], hidden[1][:, parents]))
+            if len(words) != 0:
+                out = self.sigmoid(self.fc(self.dropout(out_ltsm[torch.tensor(nodes, device=self.device), 0])))
+                outputs[torch.tensor(words, device=self.device)] = out.view(-1)
+        return outputs
+
+
+def lstm_packed_inference(inputs: torch.Tensor, batch_sizes: List[int], weights: List[torch.Tensor], h: torch.Tensor,
+                          c: torch.Tensor) -> torch.Tensor:
+    """
+    Runs a stacked LSTM over a packed batch (the rows of the words at time 0, then at time 1..., batch_sizes[t]
+    rows at time t, the words sorted by decreasing length) from the states h, c of shape (layers, batch, hidden),
+    which are updated in place and end with the state of every word after its last letter. Returns the packed
+    outputs of the last layer.
+    weights are those of nn.LSTM.all_weights, flattened. The operations are the ones of the CPU nn.LSTM on a packed
+    sequence in the same order (the input projection of a layer is a single matrix product), the states agree with it
+    up to the rounding of the matrix products (about 1e-7). It can be compiled by torch.jit.script, see
+    scripted_lstm_packed_inference.
+    """
+    for layer in range(h.size(0)):
+        w_ih, w_hh = weights[4 * layer], weights[4 * layer + 1]
+        b_ih, b_hh = weights[4 * layer + 2], weights[4 * layer + 3]
+        projected = torch.nn.functional.linear(inputs, w_ih, b_ih)
+        outputs = torch.empty(inputs.size(0), h.size(2), dtype=inputs.dtype, device=inputs.device)
+        hidden, cell = h[layer], c[layer]
+        position = 0
+        for batch_size in batch_sizes:
+            gates = torch.nn.functional.linear(hidden[:batch_size], w_hh, b_hh).add_(
+                projected[position:position + batch_size]).chunk(4, 1)
+            cy = gates[1].sigmoid().mul(cell[:batch_size]).add_(gates[0].sigmoid().mul(gates[2].tanh()))
+            hy = gates[3].sigmoid().mul(cy.tanh())
+            cell[:batch_size] = cy
+            hidden[:batch_size] = hy
+            outputs[position:position + batch_size] = hy
+            position += batch_size
+        inputs = outputs
+    return inputs
+
+
+@lru_cache(maxsize=None)
+def scripted_lstm_packed_inference():
+    with warnings.catch_warnings():
+        # torch.jit.script is deprecated in recent versions of torch, but still works
+        warnings.simplefilter("ignore", FutureWarning)
+        return torch.jit.script(lstm_packed_inference)
+
+
+PREFIX_HASH_BASE = 1000003
+# the powers of PREFIX_HASH_BASE and of its inverse mod 2 ** 64, grown as longer words are hashed
+_hash_powers = np.ones(1, dtype=np.uint64)
+_hash_inverse_powers = np.ones(1, dtype=np.uint64)
+
+
+def prefix_hashes(codes):
+    """
+    The polynomial hashes mod 2 ** 64 of all the prefixes of codes (an int array), from the empty prefix to codes
+    itself, as a list of ints. The hash of the prefix of length i is sum_j codes[j] * PREFIX_HASH_BASE ** (i - 1 - j),
+    computed for all the prefixes at once as PREFIX_HASH_BASE ** i times a cumulative sum over the inverse powers.
+    """
+    global _hash_powers, _hash_inverse_powers
+    length = len(codes)
+    if len(_hash_powers) <= length:
+        size = 1 << length.bit_length()
+        _hash_powers = np.cumprod(np.full(size + 1, PREFIX_HASH_BASE, dtype=np.uint64))
+        _hash_powers[1:] = _hash_powers[:-1]
+        _hash_powers[0] = 1
+        _hash_inverse_powers = np.cumprod(np.full(size + 1, pow(PREFIX_HASH_BASE, -1, 1 << 64), dtype=np.uint64))
+        _hash_inverse_powers[1:] = _hash_inverse_powers[:-1]
+        _hash_inverse_powers[0] = 1
+    sums = np.cumsum(np.asarray(codes, dtype=np.uint64) * _hash_inverse_powers[1:length + 1], dtype=np.uint64)
+    return [0] + (sums * _hash_powers[1:length + 1]).tolist()
+
+
+def prefix_trie_levels(words):
+    """
+    words - lists of ints.
+    Returns the prefix trie of words by levels, for level d the int64 arrays of the parent of each node (an index
+    into level d - 1, 0 for level 0 whose parent is the root) and of its letter, and for every word the (level, node)
+    of its last letter.
+    """
+    levels = []
+    children = [{}]
+    terminals = []
+    for word in words:
+        node = 0
+        for depth, letter in enumerate(word):
+            if depth == len(levels):
+                levels.append(([], []))
+                children.append({})
+            child = children[depth].get((node, letter))
+            if child is None:
+                child = len(levels[depth][0])
+                levels[depth][0].append(node)
+                levels[depth][1].append(letter)
+                children[depth][(node, letter)] = child
+            node = child
+        terminals.append((len(word) - 1, node))
+    levels = [(np.array(parents, dtype=np.int64), np.array(letters, dtype=np.int64)) for parents, letters in levels]
+    return levels, terminals
+
+
+def length_batches(lengths, max_tokens):
+    """
+    Splits the indices of words with the given lengths into batches of words of about the same length: the words are
+    sorted by length and a batch takes as many of them as fit in max_tokens letters once padded to its longest word
+    (a longer word is a batch of its own). Returns a list of index arrays.
+    """
+    order = np.argsort(lengths, kind="stable")
+    lengths = np.maximum(np.asarray(lengths), 1)[order]
+    batches = []
+    start = 0
+    while start < len(order):
+        # the last end with (end - start) * lengths[end - 1] <= max_tokens, which grows with end
+        low, high = start + 1, len(order)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if (middle - start) * lengths[middle - 1] <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        batches.append(order[start:low])
+        start = low
+    return batches
+
+
+HiddenCacheInfo = namedtuple('HiddenCacheInfo', ['hits', 'prefix_hits', 'misses', 'size', 'max_size', 'memory'])
+
 
 class RNNLanguageClasifier:
-    def __init__(self):
+    def __init__(self, hidden_cache_size=10000):
         self._rnn = None
         self._initial_state = None
         self._current_state = None
@@ -391,6 +538,11 @@ class RNNLanguageClasifier:
         self.val_acc = 0
         self.extra_time = 0
         self.num_of_membership_queries = 0
+        self.hidden_cache_size = hidden_cache_size
+        # set on the copies made by quantize, _float_rnn is the network they were made from
+        self.quantized = False
+        self._float_rnn = None
+        self.clear_hidden_cache()
 
     def train_a_lstm(self, alphahbet, target, sampler, embedding_dim=10, hidden_dim=10, num_layers=2, batch_size=20,
                      num_of_examples=5000, word_traning_length=40, epoch=20):
@@ -418,6 +570,7 @@ class RNNLanguageClasifier:
         self.val_acc = teach(self._rnn, batch_size, train_loader, val_loader, device, epochs=epoch, print_every=1000)
 
         self._initial_state = self._rnn.init_hidden(1)
+        self.clear_hidden_cache()
         self._current_state = self._initial_state
 
         self.test_acc = test_rnn(self._rnn, test_loader, batch_size, device)
@@ -427,34 +580,199 @@ class RNNLanguageClasifier:
 
     def is_word_in(self, word):
         self.num_of_membership_queries += 1
-        h = self._rnn.init_hidden(1)
         if len(word) == 0:
-            length = torch.tensor([1]).to(self._rnn.device)
-            array = torch.tensor([[0]]).to(self._rnn.device)
-        else:
-            length = torch.tensor([len(word)]).to(self._rnn.device)
-            array = torch.tensor([[self._char_to_int[l] for l in word]]).to(self._rnn.device)
-        output, h = self._rnn(array, length, h)
+            # the empty word is run as the padding letter
+            return bool(self._forward_inference(np.zeros(1, dtype=np.int64), np.ones(1, dtype=np.int64)) > 0.5)
+        _, output = self._hidden_state(word)
         return bool(output > 0.5)
 
-    def is_words_in_batch(self, words):
+    def _lstm_weights(self):
+        return [weight for layer in self._rnn.lstm.all_weights for weight in layer]
+
+    def _inference_buffers(self, batch_size):
+        """
+        Zeroed (h, c) of shape (layers, batch_size, hidden), views of buffers that are kept between calls and only
+        reallocated for a larger batch. Only for use under torch.inference_mode.
+        """
+        if self._hidden_buffers is None or self._hidden_buffers.size(2) < batch_size:
+            self._hidden_buffers = torch.zeros(2, self._rnn.n_layers, batch_size, self._rnn.hidden_dim,
+                                               device=self._rnn.device)
+        buffers = self._hidden_buffers[:, :, :batch_size]
+        buffers.zero_()
+        return buffers[0], buffers[1]
+
+    def _last_outputs(self, rows, h):
+        """
+        The outputs of the network from the packed outputs rows of the last layer and the final states h. A single
+        word goes through fc with all its rows, as in LSTM.forward, since fc on a single row rounds differently.
+        """
+        if h.size(1) == 1:
+            return self._rnn.sigmoid(self._rnn.fc(rows))[-1:].view(-1)
+        return self._rnn.sigmoid(self._rnn.fc(h[-1])).view(-1)
+
+    def _forward_inference(self, letters, lengths):
+        """
+        The outputs of the network on words given by the flat int64 array of their letters (as in _char_to_int, the
+        empty word is the padding letter 0) and their lengths (at least 1). They are those of LSTM.forward on the padded
+        words, computed by lstm_packed_inference without autograd, dropout or packing by torch.
+        """
+        order = np.argsort(-lengths, kind="stable")
+        # batch_sizes[t] - the number of words longer than t
+        batch_sizes = np.cumsum(np.bincount(lengths)[::-1])[::-1][1:]
+        # the packed rows at time t are letter t of the batch_sizes[t] longest words, longest first
+        starts = (np.cumsum(lengths) - lengths)[order]
+        times = np.repeat(np.arange(len(batch_sizes)), batch_sizes)
+        ranks = np.arange(len(times)) - np.repeat(np.cumsum(batch_sizes) - batch_sizes, batch_sizes)
+        packed = torch.from_numpy(letters[starts[ranks] + times]).to(self._rnn.device)
+
+        with torch.inference_mode():
+            h, c = self._inference_buffers(len(lengths))
+            if self.quantized:
+                # the quantized nn.LSTM keeps its weights packed as int8, it runs the packed rows itself
+                inputs = PackedSequence(self._rnn.embedding(packed), torch.tensor(batch_sizes.tolist()))
+                rows, (h, c) = self._rnn.lstm(inputs, (h, c))
+                rows = rows.data
+            else:
+                rows = scripted_lstm_packed_inference()(self._rnn.embedding(packed), batch_sizes.tolist(),
+                                                        self._lstm_weights(), h, c)
+            sorted_outputs = self._last_outputs(rows, h)
+            outputs = torch.empty_like(sorted_outputs)
+            outputs[torch.from_numpy(order).to(self._rnn.device)] = sorted_outputs
+        return outputs
+
+    def _hidden_state(self, word):
+        """
+        The (h, c) of the network after the letters of word (not empty) and its output on word. The network is only
+        run on the letters after the longest prefix of word in the hidden state cache, so asking w + a after w is a
+        single step. The state of word is then cached, the least recently used state is dropped past
+        hidden_cache_size.
+        """
+        word = tuple(word)
+        codes = np.fromiter(map(self._char_to_int.__getitem__, word), dtype=np.int64, count=len(word))
+        # the cache is keyed by the hashes of the words, so every prefix of word is looked up in constant time
+        hashes = prefix_hashes(codes)
+        cache = self._hidden_cache
+        cached = cache.get(hashes[-1])
+        if cached is not None and cached[0] == word:
+            self._hidden_cache_hits += 1
+            cache.move_to_end(hashes[-1])
+            return cached[1], cached[2]
+
+        start = len(word) - 1
+        while start > 0:
+            cached = cache.get(hashes[start])
+            if cached is not None and len(cached[0]) == start and cached[0] == word[:start]:
+                break
+            start -= 1
+        letters = torch.from_numpy(codes[start:]).to(self._rnn.device)
+        with torch.inference_mode():
+            if start > 0:
+                self._hidden_cache_prefix_hits += 1
+                hidden = cached[1]
+            else:
+                self._hidden_cache_misses += 1
+                hidden = self._rnn.init_hidden(1)
+            # a single word is a loop of small matrix products, nn.LSTM does them faster than the scripted loop
+            rows, hidden = self._rnn.lstm(self._rnn.embedding(letters)[None], hidden)
+            output = self._last_outputs(rows[0], hidden[0])[0]
+
+        cache[hashes[-1]] = (word, hidden, output)
+        if len(cache) > self.hidden_cache_size:
+            cache.popitem(last=False)
+        return hidden, output
+
+    def clear_hidden_cache(self):
+        self._hidden_buffers = None
+        self._hidden_cache = OrderedDict()
+        self._hidden_cache_hits = 0
+        self._hidden_cache_prefix_hits = 0
+        self._hidden_cache_misses = 0
+
+    def hidden_cache_info(self):
+        """
+        Statistics of the hidden state cache: the words found in it, the words run on from a cached prefix, the
+        words run from the initial state, the number of cached states, their maximal number and their memory in bytes.
+        """
+        memory = 0
+        if self._rnn is not None:
+            memory = len(self._hidden_cache) * (2 * self._rnn.n_layers * self._rnn.hidden_dim + 1) * 4
+        return HiddenCacheInfo(self._hidden_cache_hits, self._hidden_cache_prefix_hits, self._hidden_cache_misses,
+                               len(self._hidden_cache), self.hidden_cache_size, memory)
+
+    def quantize(self):
+        """
+        A copy of the classifier that answers its queries with the LSTM and fc layers dynamically quantized to int8
+        (the weights are stored as int8, the activations are quantized on the fly), which is faster on CPU but may
+        give other decisions on some words. See random_words.quantization_agreement for how often it does. save_lstm
+        of the copy saves the float network. The quantized layers only run on CPU.
+        """
+        float_rnn = self._float_rnn if self.quantized else self._rnn
+        quantized = copy(self)
+        with warnings.catch_warnings():
+            # torch.ao.quantization and quantized tensors are deprecated in recent versions of torch, but still work
+            warnings.simplefilter("ignore", DeprecationWarning)
+            warnings.simplefilter("ignore", UserWarning)
+            quantized._rnn = torch.ao.quantization.quantize_dynamic(float_rnn, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+        quantized._rnn.eval()
+        quantized.quantized = True
+        quantized._float_rnn = float_rnn
+        quantized.num_of_membership_queries = 0
+        quantized.states = {str(self.from_state_to_list(quantized._rnn.init_hidden(1))): ""}
+        quantized.clear_hidden_cache()
+        return quantized
+
+    def is_words_in_batch(self, words, offsets=None, share_prefixes=True):
+        """
+        words - a list of words, or with offsets a CSR batch (see random_words.random_words_csr): a flat int array of
+        the letters as indices into self.alphabet and the offsets of the words in it.
+        share_prefixes - run a list of words over their prefix trie (see LSTM.forward_trie), so the network computes
+        every distinct prefix once instead of every letter of every word.
+        """
+        if offsets is not None:
+            return self._is_words_in_csr_batch(words, offsets)
         self.num_of_membership_queries += len(words)
-        words_torch = [torch.tensor([self._char_to_int[l] for l in word]) if len(word) != 0 else torch.tensor([0])
-                       for word in words]
-        # for word in words:
-        #     lengths.append(len(word))
-        #     words_in_num.append([self._char_to_int[l] for l in word])
-        h = self._rnn.init_hidden(len(words))
-        # words, lengths, _ = pad_collate((words, [0]*len(words)))
-
-        x_lens = torch.Tensor([len(word) if len(word) != 0 else 1 for word in words])
-        x_lens.to(self._rnn.device)
-        # y_lens = [len(y) for y in yy]
-
-        xx_pad = pad_sequence(words_torch, batch_first=True, padding_value=0).to(self._rnn.device)
-
-        output, _ = self._rnn(xx_pad, x_lens, h)
-        return output
+        # the empty word is run as the padding letter
+        encoded = [[self._char_to_int[l] for l in word] if len(word) != 0 else [0] for word in words]
+        if share_prefixes:
+            with torch.inference_mode():
+                return self._rnn.forward_trie(*prefix_trie_levels(encoded))
+        lengths = np.array([len(word) for word in encoded], dtype=np.int64)
+        letters = np.fromiter((letter for word in encoded for letter in word), dtype=np.int64, count=lengths.sum())
+        return self._forward_inference(letters, lengths)
+
+    def is_words_in_batches(self, words, offsets=None, max_tokens=50000, share_prefixes=True):
+        """
+        Like is_words_in_batch for any number of words: the words are split by length_batches into batches of at
+        most max_tokens padded letters, each batch is run by is_words_in_batch and the outputs are returned in the
+        order of words.
+        """
+        if offsets is not None:
+            words, offsets = np.asarray(words), np.asarray(offsets)
+            lengths = np.diff(offsets)
+        else:
+            lengths = np.array([len(word) for word in words], dtype=np.int64)
+        outputs = torch.empty(len(lengths), device=self._rnn.device)
+        for batch in length_batches(lengths, max_tokens):
+            if offsets is not None:
+                batch_offsets = np.zeros(len(batch) + 1, dtype=np.int64)
+                np.cumsum(lengths[batch], out=batch_offsets[1:])
+                # the letters of every word of the batch, one after the other
+                positions = np.repeat(offsets[batch] - batch_offsets[:-1], lengths[batch]) + np.arange(batch_offsets[-1])
+                output = self.is_words_in_batch(words[positions], offsets=batch_offsets)
+            else:
+                output = self.is_words_in_batch([words[i] for i in batch], share_prefixes=share_prefixes)
+            outputs[torch.from_numpy(batch).to(self._rnn.device)] = output.detach().view(-1)
+        return outputs
+
+    def _is_words_in_csr_batch(self, letters, offsets):
+        lengths = np.diff(offsets)
+        self.num_of_membership_queries += len(lengths)
+        # letter i of the alphabet is i + 1 in _char_to_int, 0 is the padding (and the empty word, of length 1)
+        padded_lengths = np.maximum(lengths, 1)
+        codes = np.zeros(padded_lengths.sum(), dtype=np.int64)
+        shifts = np.repeat(np.cumsum(padded_lengths) - padded_lengths - np.asarray(offsets[:-1]), lengths)
+        codes[np.arange(offsets[0], offsets[-1]) + shifts] = np.asarray(letters)[offsets[0]:offsets[-1]] + 1
+        return self._forward_inference(codes, padded_lengths)
 
     def reset_current_to_init(self):
         self._current_state = self._rnn.init_hidden(1)
@@ -476,7 +794,7 @@ class RNNLanguageClasifier:
             file.write("hidden_dim = " + str(self._rnn.hidden_dim) + "\n")
             file.write("n_layers = " + str(self._rnn.n_layers) + "\n")
             file.write("torch_save = state_dict.pt")
-        torch.save(self._rnn.state_dict(), dir_name + "/state_dict.pt")
+        torch.save((self._float_rnn if self.quantized else self._rnn).state_dict(), dir_name + "/state_dict.pt")
 
     def load_lstm(self, dir_name):
         is_cuda = torch.cuda.is_available()
@@ -504,9 +822,9 @@ class RNNLanguageClasifier:
         self._rnn = LSTM(len(self.alphabet) + 1, 1, embedding_dim, hidden_dim, n_layers, drop_prob=0.5, device=device)
         self._rnn.load_state_dict(torch.load(dir_name + "/" + torch_save, map_location={'cuda:0': 'cpu'}))
         self._rnn.eval()
-        torch.no_grad()
 
         self._initial_state = self._rnn.init_hidden(1)
+        self.clear_hidden_cache()
         self._current_state = self._initial_state
         self._char_to_int = {self.alphabet[i]: i + 1 for i in range(len(self.alphabet))}
         self._char_to_int.update({"": 0})
@@ -530,14 +848,7 @@ class RNNLanguageClasifier:
     def get_next_RState(self, state, char):
         start_time = time.time()
         word = self.states[str(state)] + char
-        h = self._rnn.init_hidden(1)
-        if len(word) == 0:
-            length = torch.tensor([1]).to(self._rnn.device)
-            array = torch.tensor([[0]]).to(self._rnn.device)
-        else:
-            length = torch.tensor([len(word)]).to(self._rnn.device)
-            array = torch.tensor([[self._char_to_int[l] for l in word]]).to(self._rnn.device)
-        output, h = self._rnn(array, length, h)
+        h, output = self._hidden_state(word)
 
         state_list = self.from_state_to_list(h)
         self.states.update({str(state_list): word})
@@ -7,25 +7,42 @@ import numpy as np
 from dfa import DFA
 from dfa_check import DFAChecker
 from modelPadding import RNNLanguageClasifier
-from random_words import random_word, confidence_interval_many, confidence_interval_many_for_reuse
+from random_words import random_word, confidence_interval_many, confidence_interval_many_for_reuse, \
+    random_words_csr, words_from_csr, is_words_in_csr
 from teacher import Teacher
-from randwords import random_words, is_words_in_dfa,compare_list_of_bool
 
 class PACTeacher(Teacher):
 
-    def __init__(self, model: DFA, epsilon=0.001, delta=0.001):
+    def __init__(self, model: DFA, epsilon=0.001, delta=0.001, oracle=None, seed=None):
+        """
+        seed - an int or a numpy.random.Generator for the words drawn for an RNN (see random_words_csr), the same int
+        always asks the same words.
+        """
         assert ((epsilon <= 1) & (delta <= 1))
-        Teacher.__init__(self, model)
+        Teacher.__init__(self, model, oracle)
         self.epsilon = epsilon
         self.delta = delta
         self._log_delta = np.log(delta)
         self._log_one_minus_epsilon = np.log(1 - epsilon)
         self._num_equivalence_asked = 0
-
-        self.prev_examples = {}
+        self._rng = np.random.default_rng(seed)
 
         self.is_counter_example_in_batches = isinstance(self.model, RNNLanguageClasifier)
         print("counter example in batchs : " + str(self.is_counter_example_in_batches))
+
+    def _first_random_counterexample(self, dfa: DFA, batch_size, is_counterexample):
+        """
+        Draws a CSR batch of batch_size words, classifies it by the model and by dfa and returns the first word on
+        which is_counterexample(in model, in dfa) holds (on bool arrays), None if there is none.
+        """
+        alphabet = list(self.model.alphabet)
+        letters, offsets = random_words_csr(batch_size, alphabet, seed=self._rng)
+        found = np.flatnonzero(is_counterexample(is_words_in_csr(self.model, letters, offsets, alphabet),
+                                                 is_words_in_csr(dfa, letters, offsets, alphabet)))
+        if len(found) == 0:
+            return None
+        return words_from_csr(letters, offsets[found[0]:found[0] + 2], alphabet)[0]
+
     def equivalence_query(self, dfa: DFA):
         """
         Tests whether the dfa is equivalent to the model by testing random words.
@@ -46,12 +63,9 @@ class PACTeacher(Teacher):
         if self.is_counter_example_in_batches:
             batch_size = 200
             for i in range(int(number_of_rounds / batch_size) + 1):
-                batch = random_words(batch_size,self.alphabet)
-                # batch = [random_word(self.model.alphabet) for _ in range(batch_size)]
-                for x, y, w in zip(self.model.is_words_in_batch(batch) > 0.5, is_words_in_dfa(dfa,batch),
-                                   batch):
-                    if x != y:
-                        return w
+                counter_example = self._first_random_counterexample(dfa, batch_size, np.not_equal)
+                if counter_example is not None:
+                    return counter_example
             return None
 
         else:
@@ -82,11 +96,9 @@ class PACTeacher(Teacher):
         if isinstance(self.model, RNNLanguageClasifier):
             batch_size = 200
             for i in range(int(number_of_rounds / batch_size) + 1):
-                batch = [random_word(self.model.alphabet) for _ in range(batch_size)]
-                for x, y, w in zip(self.model.is_words_in_batch(batch) > 0.5, [dfa.is_word_in(w) for w in batch],
-                                   batch):
-                    if x and (not y):
-                        return w
+                counter_example = self._first_random_counterexample(dfa, batch_size, np.greater)
+                if counter_example is not None:
+                    return counter_example
             return None
 
         else:
@@ -97,7 +109,7 @@ class PACTeacher(Teacher):
             return None
 
     def membership_query(self, word):
-        return self.model.is_word_in(word)
+        return self.oracle.is_word_in(word)
 
     def teach(self, learner, timeout=600):
         self._num_equivalence_asked = 0
@@ -236,7 +248,7 @@ class PACTeacher(Teacher):
             counter_example = checker.check_for_counterexample(learner.dfa)
 
             if counter_example is not None:
-                if not self.model.is_word_in(counter_example):
+                if not self.membership_query(counter_example):
                     self._num_equivalence_asked += 1
                     num = learner.new_counterexample(counter_example, self.is_counter_example_in_batches)
                     if num > 1:
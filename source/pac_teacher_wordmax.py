@@ -13,10 +13,10 @@ from teacher import Teacher
 
 class PACTeacherMeme(Teacher):
 
-    def __init__(self, model: DFA, epsilon=0.001, delta=0.001):
+    def __init__(self, model: DFA, epsilon=0.001, delta=0.001, oracle=None):
         assert ((epsilon <= 1) & (delta <= 1))
 
-        Teacher.__init__(self, model)
+        Teacher.__init__(self, model, oracle)
         self.epsilon = epsilon
         self.delta = delta
         self._log_delta = np.log(delta)
@@ -26,8 +26,6 @@ class PACTeacherMeme(Teacher):
 
         print("meme pac teacher: " +str(self._num_mem_quries_allowed))
 
-        self.prev_examples = {}
-
         self.is_counter_example_in_batches = isinstance(self.model, RNNLanguageClasifier)
 
     def equivalence_query(self, dfa: DFA):
@@ -50,7 +48,7 @@ class PACTeacherMeme(Teacher):
             for i in range(int(number_of_rounds / batch_size) + 1):
                 self._num_mem_quries_allowed -= batch_size
                 batch = [random_word(self.model.alphabet) for _ in range(batch_size)]
-                for x, y, w in zip(self.model.is_words_in_batch(batch) > 0.5, [dfa.is_word_in(w) for w in batch],
+                for x, y, w in zip(self.model.is_words_in_batch(batch) > 0.5, dfa.is_words_in_batch(batch),
                                    batch):
                     if x != y:
                         return w
@@ -75,7 +73,7 @@ class PACTeacherMeme(Teacher):
             self._num_mem_quries_allowed -= 200
             for i in range(int(number_of_rounds / batch_size) + 1):
                 batch = [random_word(self.model.alphabet) for _ in range(batch_size)]
-                for x, y, w in zip(self.model.is_words_in_batch(batch) > 0.5, [dfa.is_word_in(w) for w in batch],
+                for x, y, w in zip(self.model.is_words_in_batch(batch) > 0.5, dfa.is_words_in_batch(batch),
                                   batch):
                     if x and (not y):
                         if not spec.is_word_in(w):
@@ -92,7 +90,7 @@ class PACTeacherMeme(Teacher):
             return None
 
     def membership_query(self, word):
-        return self.model.is_word_in(word)
+        return self.oracle.is_word_in(word)
 
     def teach(self, learne,spec, maxWords):
         self._num_mem_quries_allowed = maxWords
@@ -118,7 +116,7 @@ class PACTeacherMeme(Teacher):
             counter_example = checker.check_for_counterexample(learner.dfa)
 
             if counter_example is not None:
-                if not self.model.is_word_in(counter_example):
+                if not self.membership_query(counter_example):
                     self._num_equivalence_asked += 1
                     num = learner.new_counterexample(counter_example, self.is_counter_example_in_batches)
                     if num > 1:
@@ -1,11 +1,13 @@
 import sys
 import time
+from collections import namedtuple
+
 import numpy as np
 import torch
 
-from dfa import DFA
+from dfa import DFA, DFANoisy
 from modelPadding import LSTM, RNNLanguageClasifier
-from randwords import random_words, is_words_in_dfa,compare_list_of_bool
+from randwords import random_words
 
 
 # def random_word_func_entropy_dfa(dfa:DFA,p=0.01):
@@ -22,6 +24,32 @@ def random_word(alphabet, p=0.01):
     return tuple(word)
 
 
+def random_words_csr(num_of_words, alphabet, p=0.01, seed=None):
+    """
+    Draws num_of_words words from the distribution of random_word, all at once: the lengths from the geometric
+    distribution and all the letters as one int array.
+    Returns the words as a CSR batch (letters, offsets), word i is letters[offsets[i]:offsets[i + 1]] and the letters
+    are indices into alphabet. It can be given as is to the is_words_in_batch of a DFA or an RNNLanguageClasifier
+    with the alphabet in the same order.
+    seed - an int or a numpy.random.Generator (PCG64), the same int always gives the same words.
+    """
+    rng = np.random.default_rng(seed)
+    # numpy's geometric counts the trials up to and including the first stop
+    lengths = rng.geometric(p, size=int(num_of_words)) - 1
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    letters = rng.integers(0, len(alphabet), size=int(offsets[-1]), dtype=np.int32)
+    return letters, offsets
+
+
+def words_from_csr(letters, offsets, alphabet):
+    """
+    The CSR batch as a list of tuples of letters of alphabet (for the code that works on words).
+    """
+    alphabet = np.asarray(alphabet, dtype=object)
+    return [tuple(alphabet[letters[start:end]]) for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
 def random_word_by_letter(alphabet, p=0.01):
     nums_of_letters = len(alphabet)
     while np.random.randint(0, int(1 / p)) != 0:
@@ -176,23 +204,11 @@ def confidence_interval_many_cython(languages, confidence=0.001, width=0.005, sa
                 #     # in_langs_lists.append([lang.is_word_in(w) for w in samples])
                 # else:
                     # print("")
-                in_langs_lists.append(is_words_in_dfa(lang, samples))
+                in_langs_lists.append(lang.is_words_in_batch(samples))
                 # in_langs_lists.append([lang.is_word_in(w) for w in samples])
                 # print(in_langs_lists)
             else:
-                rnn_bool_list = []
-                batch_size = 1000
-                num_of_batches = int((len(samples) / batch_size))
-                for i in range(num_of_batches):
-                    if i % 50 == 0:
-                        print("done {}/{}".format(i, num_of_batches))
-                    batch = samples[i * batch_size:(i + 1) * batch_size]
-                    batch_out = (lang.is_words_in_batch(batch) > 0.5).cpu().numpy()
-                    rnn_bool_list.extend(batch_out)
-                batch = samples[num_of_batches * batch_size:len(samples)]
-                batch_out = (lang.is_words_in_batch(batch) > 0.5).cpu().numpy()
-                rnn_bool_list.extend(batch_out)
-                in_langs_lists.append(rnn_bool_list)
+                in_langs_lists.append((lang.is_words_in_batches(samples) > 0.5).cpu().numpy())
 
 
         print("compearing bool lists")
@@ -241,22 +257,12 @@ def confidence_interval_many(languages, sampler, confidence=0.001, width=0.005,
     sys.stdout.write('\r Creating bool lists for each lan:  {}/{} done'.format(i, num_of_lan))
     torch.cuda.empty_cache()
     for lang in languages:
-        if not isinstance(lang, RNNLanguageClasifier):
+        if isinstance(lang, DFA):
+            in_langs_lists.append(lang.is_words_in_batch(samples))
+        elif not isinstance(lang, RNNLanguageClasifier):
             in_langs_lists.append([lang.is_word_in(w) for w in samples])
         else:
-            rnn_bool_list = []
-            batch_size = 1000
-            num_of_batches = int((len(samples) / batch_size))
-            for i in range(num_of_batches):
-                if i % 50 == 0:
-                    print("done {}/{}".format(i, num_of_batches))
-                batch = samples[i * batch_size:(i + 1) * batch_size]
-                batch_out = (lang.is_words_in_batch(batch) > 0.5)
-                rnn_bool_list.extend(batch_out)
-            batch = samples[num_of_batches * batch_size:len(samples)]
-            batch_out = (lang.is_words_in_batch(batch) > 0.5)
-            rnn_bool_list.extend(batch_out)
-            in_langs_lists.append(rnn_bool_list)
+            in_langs_lists.append((lang.is_words_in_batches(samples) > 0.5).cpu().numpy())
 
     output = []
     for i in range(num_of_lan):
@@ -274,6 +280,114 @@ def confidence_interval_many(languages, sampler, confidence=0.001, width=0.005,
     return output, samples
 
 
+# Reported to the progress callback of confidence_interval_many_streaming after every chunk.
+SamplingProgress = namedtuple('SamplingProgress', ['words_done', 'num_of_samples', 'disagreements'])
+
+
+def is_words_in_csr(lang, letters, offsets, alphabet, rnn_max_tokens=50000):
+    """
+    Classifies a CSR batch of letters of alphabet by lang, which may list the same letters in another order. An RNN
+    runs it in batches of words of about the same length, of at most rnn_max_tokens padded letters.
+    """
+    lang_alphabet = list(lang.alphabet)
+    if lang_alphabet != alphabet:
+        letters = np.array([lang_alphabet.index(letter) for letter in alphabet], dtype=np.int32)[letters]
+        alphabet = lang_alphabet
+
+    if isinstance(lang, RNNLanguageClasifier):
+        return (lang.is_words_in_batches(letters, offsets=offsets, max_tokens=rnn_max_tokens) > 0.5).cpu().numpy()
+    if isinstance(lang, DFA) and not isinstance(lang, DFANoisy):
+        return lang.is_words_in_batch(letters, offsets=offsets)
+    return np.array([lang.is_word_in(w) for w in words_from_csr(letters, offsets, alphabet)], dtype=bool)
+
+
+def confidence_interval_many_streaming(languages, confidence=0.001, width=0.005, word_prob=0.01, chunk_size=100000,
+                                       seed=None, progress=None, pairs=None):
+    """
+    The same estimate as confidence_interval_many (the Chernoff-Hoeffding bound gives the number of samples:
+    log(2 / confidence) / (2 * width * width)), without ever holding the whole sample: the words are drawn a chunk
+    at a time by random_words_csr, classified in batch by every language and only the pairwise disagreement counts
+    are kept. The memory used depends on chunk_size and not on width.
+
+    progress - called with a SamplingProgress after every chunk.
+    pairs - the (i, j) of the distances to estimate, all of them by default. The others are nan and the languages
+    that are in no pair are not asked.
+    Returns the matrix of the distances as a list of lists.
+    """
+    num_of_lan = len(languages)
+    if num_of_lan < 2:
+        raise Exception("Need at least 2 languages to compare")
+
+    num_of_samples = int(np.log(2 / confidence) / (2 * width * width))
+    alphabet = list(languages[0].alphabet)
+    rng = np.random.default_rng(seed)
+    torch.cuda.empty_cache()
+
+    if pairs is None:
+        pairs = [(i, j) for i in range(num_of_lan) for j in range(i + 1, num_of_lan)]
+    first, second = np.array(pairs, dtype=np.int64).reshape(-1, 2).T
+    asked = np.unique(np.concatenate([first, second]))
+
+    disagreements = np.zeros((num_of_lan, num_of_lan), dtype=np.int64)
+    words_done = 0
+    while words_done < num_of_samples:
+        letters, offsets = random_words_csr(min(chunk_size, num_of_samples - words_done), alphabet, word_prob, rng)
+        in_langs = np.zeros((num_of_lan, len(offsets) - 1), dtype=bool)
+        for i in asked:
+            in_langs[i] = is_words_in_csr(languages[i], letters, offsets, alphabet)
+        counts = (in_langs[first] != in_langs[second]).sum(axis=1)
+        disagreements[first, second] += counts
+        disagreements[second, first] += counts
+        words_done += len(offsets) - 1
+        if progress is not None:
+            progress(SamplingProgress(words_done, num_of_samples, disagreements.copy()))
+
+    distances = disagreements / max(num_of_samples, 1)
+    estimated = np.eye(num_of_lan, dtype=bool)
+    estimated[first, second] = estimated[second, first] = True
+    distances[~estimated] = np.nan
+    return distances.tolist()
+
+
+# The result of quantization_agreement, the times are the seconds spent classifying the sample by each model.
+QuantizationAgreement = namedtuple('QuantizationAgreement', ['num_of_samples', 'disagreements', 'disagreement_rate',
+                                                             'upper_bound', 'float_time', 'quantized_time'])
+
+
+def quantization_agreement(rnn, quantized=None, confidence=0.001, width=0.005, word_prob=0.01, chunk_size=100000,
+                           seed=None):
+    """
+    How often the dynamic int8 quantized copy of the RNNLanguageClasifier rnn (rnn.quantize() unless given) decides
+    otherwise than rnn on words drawn a chunk at a time by random_words_csr, with the number of samples of
+    confidence_interval_many_streaming: with probability 1 - confidence the rate of such words is at most
+    upper_bound = disagreement_rate + width.
+    The times tell the speedup the quantized copy gives on the same words.
+    """
+    if quantized is None:
+        quantized = rnn.quantize()
+    num_of_samples = int(np.log(2 / confidence) / (2 * width * width))
+    alphabet = list(rnn.alphabet)
+    rng = np.random.default_rng(seed)
+
+    disagreements = 0
+    float_time, quantized_time = 0, 0
+    words_done = 0
+    while words_done < num_of_samples:
+        letters, offsets = random_words_csr(min(chunk_size, num_of_samples - words_done), alphabet, word_prob, rng)
+        start_time = time.time()
+        in_float = is_words_in_csr(rnn, letters, offsets, alphabet)
+        float_time += time.time() - start_time
+        start_time = time.time()
+        in_quantized = is_words_in_csr(quantized, letters, offsets, alphabet)
+        quantized_time += time.time() - start_time
+        disagreements += int((in_float != in_quantized).sum())
+        words_done += len(offsets) - 1
+
+    rate = disagreements / max(num_of_samples, 1)
+    return QuantizationAgreement(num_of_samples, disagreements, rate, min(rate + width, 1.0), float_time,
+                                 quantized_time)
+
+
 def confidence_interval_subset(language_inf, language_sup, samples=None, confidence=0.001, width=0.001):
     """
     Getting the confidence interval(width,confidence) using the Chernoff-Hoeffding bound.
@@ -342,24 +456,12 @@ def confidence_interval_many_for_reuse(languages, sampler, previous_answers=None
     if previous_answers is None:
         for lang in languages:
             if isinstance(lang, DFA):
-                in_langs_lists.append([lang.is_word_in(w) for w in samples])
+                in_langs_lists.append(lang.is_words_in_batch(samples))
             else:
-                rnn_bool_list = []
-                batch_size = 1000
-                n = int((len(samples) / batch_size))
-                for i in range(n):
-                    if i % 50 == 0:
-                        print("done {}/{}".format(i, n))
-                    batch = samples[i * batch_size:(i + 1) * batch_size]
-                    batch_out = (lang.is_words_in_batch(batch) > 0.5)
-                    rnn_bool_list.extend(batch_out)
-                batch = samples[n * batch_size:len(samples)]
-                batch_out = (lang.is_words_in_batch(batch) > 0.5)
-                rnn_bool_list.extend(batch_out)
-                in_langs_lists.append(rnn_bool_list)
+                in_langs_lists.append((lang.is_words_in_batches(samples) > 0.5).cpu().numpy())
     else:
         in_langs_lists = previous_answers
-        in_langs_lists.append([languages[2].is_word_in(w) for w in samples])
+        in_langs_lists.append(languages[2].is_words_in_batch(samples))
         # print(in_langs_lists)
     output = []
     for _ in range(num_of_lan):
@@ -392,7 +494,7 @@ def model_check_random(language_inf, language_sup,  confidence=0.001, width=0.00
         if (time.time() -start_time > 600):
             return None
         batch = [random_word(alph) for _ in range(batch_size)]
-        for x, y, w in zip(language_inf.is_words_in_batch(batch) > 0.5, [language_sup.is_word_in(w) for w in batch],
+        for x, y, w in zip(language_inf.is_words_in_batch(batch) > 0.5, language_sup.is_words_in_batch(batch),
                            batch):
             if x and (not y):
                 # short_word = ""
@@ -1,20 +1,28 @@
 from abc import ABC, abstractmethod
 
 from dfa import DFA
+from membership_oracle import shared_oracle
 
 
 class Teacher(ABC):
-    def __init__(self, model: DFA):
+    def __init__(self, model: DFA, oracle=None):
         """
         Constructor
         """
         self.model = model
         self.alphabet = model.alphabet
+        self.oracle = shared_oracle(model) if oracle is None else oracle
 
     @abstractmethod
     def membership_query(self, word):
         raise NotImplementedError()
 
+    def membership_queries(self, words):
+        """
+        The answers to the membership queries of words as a list, the new ones asked from the model in one batch.
+        """
+        return self.oracle.is_words_in_batch(words).tolist()
+
     @abstractmethod
     def equivalence_query(self, dfa):
         raise NotImplementedError()
@@ -1,12 +1,37 @@
+import tempfile
 import time
 import timeit
 import unittest
 
-from dfa import DFA, random_dfa, dfa_intersection
+import numpy as np
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from dfa import DFA, ProductDFA, random_dfa, dfa_intersection, dfa_distance, load_dfa, load_dfa_npz, \
+    save_dfa_as_part_of_model
 from dfa_check import DFAChecker
 from exact_teacher import ExactTeacher
-from learner_decison_tree import DecisionTreeLearner
+from learner_decison_tree import DecisionTreeLearner, DiscriminationTree
+from learner_lsharp import LSharpLearner
+from learner_ttt import TTTLearner
+from membership_oracle import MembershipOracle, model_hash
+from modelPadding import LSTM, RNNLanguageClasifier, length_batches, prefix_trie_levels, prefix_hashes, \
+    PREFIX_HASH_BASE
 from pac_teacher import PACTeacher
+from random_words import random_words_csr, words_from_csr, confidence_interval_many_streaming, quantization_agreement
+from word_trie import WordTrie
+
+
+def _small_rnn(**kwargs):
+    """
+    An untrained RNNLanguageClasifier over a, b, c with a small network, for the tests of its queries.
+    """
+    rnn = RNNLanguageClasifier(**kwargs)
+    rnn.alphabet = ["a", "b", "c"]
+    rnn._char_to_int = {"": 0, "a": 1, "b": 2, "c": 3}
+    rnn._rnn = LSTM(4, 1, 5, 8, 2)
+    rnn._rnn.eval()
+    return rnn
 
 
 class Test(unittest.TestCase):
@@ -49,6 +74,203 @@ class Test(unittest.TestCase):
         self.assertTrue(dfa_0_inter_2.is_language_not_subset_of(dfa2) is None)
         self.assertTrue(dfa_0_inter_2.is_language_not_subset_of(dfa1) is None)
 
+    def test_compiled_dfa(self):
+        dfa = DFA("s1", ["s1"], {"s1": {"a": "s2", "b": "s1"},
+                                 "s2": {"a": "s3", "b": "s1"},
+                                 "s3": {"a": "s3", "b": "s3"}})
+        compiled = dfa.compiled
+        self.assertEqual(compiled.labels[0], "s1")
+        self.assertEqual(compiled.transitions.shape, (3, 2))
+        self.assertEqual(compiled.transitions.dtype, np.int32)
+        self.assertEqual(compiled.accepting.tolist(), [True, False, False])
+        self.assertEqual(compiled.labels[compiled.run(compiled.encode_word("aa"))], "s3")
+        for word in ["", "ab", "abab", "aab", "ba"]:
+            self.assertEqual(dfa.is_word_in(word), compiled.is_word_in(word))
+
+    def test_dfa_batch(self):
+        dfa = random_dfa(["a", "b", "c"], min_states=10, max_states=20, min_final=2, max_final=5)
+        words = [tuple(np.random.choice(dfa.alphabet, size=np.random.randint(0, 30))) for _ in range(500)]
+        expected = [dfa.is_word_in(w) for w in words]
+        self.assertEqual(dfa.is_words_in_batch(words).tolist(), expected)
+
+        letters, offsets = dfa.compiled.encode_words(words)
+        self.assertEqual(dfa.is_words_in_batch(letters, offsets=offsets).tolist(), expected)
+
+        lengths = np.diff(offsets)
+        padded = np.zeros((len(words), lengths.max()), dtype=np.int32)
+        padded[np.arange(lengths.max()) < lengths[:, None]] = letters
+        self.assertEqual(dfa.is_words_in_batch(padded, lengths=lengths).tolist(), expected)
+
+    def test_equivalence_counterexample(self):
+        dfa1 = DFA(1, {1}, {1: {"a": 2, "b": 1, "c": 1},
+                            2: {"a": 3, "b": 1, "c": 3},
+                            3: {"a": 3, "b": 3, "c": 3}})
+        dfa2 = DFA(1, {1, 4}, {1: {"a": 2, "b": 1, "c": 1},
+                               2: {"a": 3, "b": 1, "c": 3},
+                               3: {"a": 3, "b": 3, "c": 4},
+                               4: {"a": 3, "b": 3, "c": 4}})
+        # the words of length 3 "aac" and "acc" are the shortest ones on which the two differ
+        counter_example = dfa1.equivalence_with_counterexample(dfa2)
+        self.assertEqual(len(counter_example), 3)
+        self.assertTrue(dfa1.is_word_in(counter_example) != dfa2.is_word_in(counter_example))
+        self.assertEqual(len(dfa2.is_language_not_subset_of(dfa1)), 3)
+        self.assertTrue(dfa1.is_language_not_subset_of(dfa2) is None)
+        self.assertFalse(dfa1 == dfa2)
+        self.assertTrue(dfa2 == dfa2.minimize())
+
+    def test_canonical_hash(self):
+        # both with the language immediately after every "a" there is a "b", over differently ordered alphabets
+        dfa1 = DFA(1, {1}, {1: {"a": 2, "b": 1, "c": 1},
+                            2: {"a": 3, "b": 1, "c": 3},
+                            3: {"a": 3, "b": 3, "c": 3}})
+        dfa3 = DFA(1, {1, 5}, {1: {"c": 5, "b": 5, "a": 2},
+                               2: {"c": 3, "b": 1, "a": 3},
+                               3: {"c": 4, "b": 4, "a": 4},
+                               4: {"c": 3, "b": 3, "a": 3},
+                               5: {"c": 1, "b": 1, "a": 2}})
+        self.assertEqual(dfa1.canonical_form(), dfa3.canonical_form())
+        self.assertEqual(hash(dfa1), hash(dfa3))
+        self.assertEqual(len({dfa1, dfa3, dfa3.minimize()}), 1)
+
+        dfa_rand = random_dfa(["a", "b", "c"], min_states=10, max_states=20, min_final=2, max_final=9)
+        complement = DFA(dfa_rand.init_state, [s for s in dfa_rand.states if s not in dfa_rand.final_states],
+                         dfa_rand.transitions)
+        self.assertEqual(len({dfa_rand, complement, dfa_rand.minimize()}), 2)
+
+    def test_minimize(self):
+        # dfa with the language immediately after every "a" there is a "b", with a duplicated and unreachable state
+        dfa = DFA(1, {1, 5}, {1: {"a": 2, "b": 5, "c": 5},
+                              2: {"a": 3, "b": 1, "c": 3},
+                              3: {"a": 4, "b": 4, "c": 4},
+                              4: {"a": 3, "b": 3, "c": 3},
+                              5: {"a": 2, "b": 1, "c": 1},
+                              6: {"a": 1, "b": 6, "c": 2}})
+        minimal = dfa.minimize()
+        self.assertEqual(len(minimal.states), 3)
+        self.assertEqual(minimal.init_state, tuple())
+        self.assertTrue(minimal == dfa)
+
+        for _ in range(10):
+            dfa_rand = random_dfa(["a", "b", "c", "d"], min_states=10, max_states=30, min_final=2, max_final=9)
+            minimal = dfa_rand.minimize()
+            teacher_exact = ExactTeacher(dfa_rand)
+            student_exact = DecisionTreeLearner(teacher_exact)
+            teacher_exact.teach(student_exact)
+            self.assertTrue(minimal == dfa_rand)
+            self.assertEqual(len(minimal.states), len(student_exact.dfa.states))
+            self.assertEqual(minimal.minimize().transitions, minimal.transitions)
+
+    def test_save_npz(self):
+        dfa = DFA(("",), [("",), ("b",)], {("",): {"a": ("a",), "b": ("b",)},
+                                           ("a",): {"a": ("a",), "b": ("b",)},
+                                           ("b",): {"a": ("a",), "b": ("b",)}})
+        dfa_rand = random_dfa(["a", "b", "c"], min_states=10, max_states=20, min_final=2, max_final=5)
+        with tempfile.TemporaryDirectory() as folder:
+            for i, original in enumerate([dfa, dfa_rand]):
+                filename = folder + "/dfa" + str(i)
+                original.save(filename)
+                original.save_npz(filename)
+                # memory mapped, only the transitions of the states looked up are built
+                mapped = load_dfa_npz(filename + ".npz", mmap=True)
+                self.assertIsInstance(mapped.compiled.transitions, np.memmap)
+                self.assertEqual(mapped.transitions[original.init_state], original.transitions[original.init_state])
+                self.assertEqual(len(mapped.transitions._created), 1)
+                self.assertEqual(set(mapped.states), set(original.states))
+                for loaded in [load_dfa(filename), load_dfa_npz(filename + ".npz", mmap=True)]:
+                    self.assertEqual(loaded.init_state, original.init_state)
+                    self.assertEqual(loaded.transitions, original.transitions)
+                    self.assertEqual(set(loaded.final_states), set(original.final_states))
+                    self.assertTrue(np.array_equal(loaded.compiled.transitions, original.compiled.transitions))
+
+    def test_random_words_csr(self):
+        dfa = random_dfa(["a", "b", "c"], min_states=10, max_states=20, min_final=2, max_final=5)
+        letters, offsets = random_words_csr(5000, dfa.alphabet, p=0.05, seed=7)
+        letters_again, offsets_again = random_words_csr(5000, dfa.alphabet, p=0.05, seed=7)
+        self.assertTrue(np.array_equal(letters, letters_again) and np.array_equal(offsets, offsets_again))
+        self.assertEqual(len(offsets), 5001)
+        # the mean length of the geometric distribution is (1 - p) / p
+        self.assertAlmostEqual(offsets[-1] / 5000, 19, delta=1.5)
+
+        words = words_from_csr(letters, offsets, dfa.alphabet)
+        self.assertEqual(dfa.is_words_in_batch(letters, offsets=offsets).tolist(), dfa.is_words_in_batch(words).tolist())
+
+    def test_confidence_interval_streaming(self):
+        dfa1 = random_dfa(["a", "b", "c"], min_states=10, max_states=20, min_final=2, max_final=5)
+        dfa2 = random_dfa(["c", "b", "a"], min_states=10, max_states=20, min_final=2, max_final=5)
+        progress = []
+        output = confidence_interval_many_streaming([dfa1, dfa2, dfa1], confidence=0.01, width=0.02, word_prob=0.1,
+                                                    chunk_size=1000, seed=1, progress=progress.append)
+        self.assertEqual(progress[-1].words_done, progress[-1].num_of_samples)
+        self.assertTrue(all(p.words_done <= 1000 * (i + 1) for i, p in enumerate(progress)))
+        self.assertEqual(output[0][2], 0)
+        self.assertEqual(output[0][1], output[1][0])
+        self.assertAlmostEqual(output[0][1], dfa_distance(dfa1, dfa2, p=0.1), delta=0.02)
+        # only the pairs asked for are estimated, from the same words
+        some = confidence_interval_many_streaming([dfa1, dfa2, dfa1], confidence=0.01, width=0.02, word_prob=0.1,
+                                                  chunk_size=1000, seed=1, pairs=[(0, 1)])
+        self.assertEqual(some[1][0], output[1][0])
+        self.assertTrue(np.isnan(some[0][2]) and np.isnan(some[2][1]))
+
+    def test_product_dfa(self):
+        dfa1 = random_dfa(["a", "b", "c"], min_states=10, max_states=20, min_final=2, max_final=5)
+        dfa2 = random_dfa(["c", "b", "a"], min_states=10, max_states=20, min_final=2, max_final=5)
+        words = [tuple(np.random.choice(dfa1.alphabet, size=np.random.randint(0, 20))) for _ in range(200)]
+        in1, in2 = dfa1.is_words_in_batch(words), dfa2.is_words_in_batch(words)
+        expected = {"intersection": in1 & in2, "union": in1 | in2, "difference": in1 & ~in2,
+                    "symmetric_difference": in1 != in2}
+        for operation in expected:
+            product = ProductDFA(dfa1, dfa2, operation)
+            self.assertEqual([product.is_word_in(w) for w in words], expected[operation].tolist())
+            self.assertEqual(product.is_words_in_batch(words).tolist(), expected[operation].tolist())
+
+        # only the pairs on the way of the word are created
+        product = ProductDFA(dfa1, dfa2, "union")
+        product.is_word_in(("a", "b"))
+        self.assertTrue(len(product.transitions) <= 2)
+        self.assertEqual(product.compiled.labels[0], product.init_state)
+        self.assertTrue(ProductDFA(dfa1, dfa2, "difference").is_language_not_subset_of(dfa1) is None)
+
+        # saving goes over all the reachable pairs, not only the ones looked up so far
+        product = dfa_intersection(dfa1, dfa2)
+        with tempfile.TemporaryDirectory() as folder:
+            save_dfa_as_part_of_model(folder, product)
+            with open(folder + "/dfa.dot") as file:
+                edges = [line for line in file if " -> " in line and "[label=" in line]
+            self.assertEqual(len(edges), len(product.states) * len(product.alphabet))
+            loaded = load_dfa(folder + "/dfa")
+            self.assertEqual(list(loaded.states), product.states)
+            self.assertTrue(loaded == product)
+
+    def test_dfa_distance(self):
+        # dfa with the language a*, a word is in it iff it never picks "b", so the distance to the empty language is
+        # sum_n (1-p)^n p / 2^n = p / (1 - (1 - p) / 2)
+        dfa = DFA(1, {1}, {1: {"a": 1, "b": 2},
+                           2: {"a": 2, "b": 2}})
+        empty = DFA(1, {}, {1: {"a": 1, "b": 1}})
+        self.assertAlmostEqual(dfa_distance(dfa, empty, p=0.1), 0.1 / (1 - 0.9 / 2))
+        self.assertEqual(dfa_distance(dfa, dfa.minimize()), 0)
+
+        dfa1 = random_dfa(["a", "b", "c"], min_states=10, max_states=20, min_final=2, max_final=5)
+        dfa2 = random_dfa(["c", "b", "a"], min_states=10, max_states=20, min_final=2, max_final=5)
+        words = [tuple(np.random.choice(dfa1.alphabet, size=np.random.geometric(0.1) - 1)) for _ in range(20000)]
+        sampled = np.mean(dfa1.is_words_in_batch(words) != dfa2.is_words_in_batch(words))
+        self.assertAlmostEqual(dfa_distance(dfa1, dfa2, p=0.1), sampled, delta=0.03)
+
+    def test_word_trie(self):
+        words = WordTrie()
+        ab = words.intern(("a", "b"))
+        self.assertEqual(words.extend(words.extend(WordTrie.EMPTY, "a"), "b"), ab)
+        self.assertEqual(words.word(ab), ("a", "b"))
+        self.assertEqual(words.word(WordTrie.EMPTY), tuple())
+
+        abba = words.concat(ab, words.intern(("b", "a")))
+        self.assertEqual(words.concat(ab, words.intern(("b", "a"))), abba)
+        self.assertEqual(words.concat(ab, WordTrie.EMPTY), ab)
+        self.assertEqual(words.word(abba), ("a", "b", "b", "a"))
+        self.assertEqual(words.length(abba), 4)
+        # extending a concatenation goes on from the trie
+        self.assertEqual(words.extend(abba, "c"), words.intern(("a", "b", "b", "a", "c")))
+
     def test_learning_algo(self):
         dfa = DFA(1, {1}, {1: {"a": 2, "b": 1, "c": 1},
                            2: {"a": 3, "b": 1, "c": 3},
@@ -71,6 +293,296 @@ class Test(unittest.TestCase):
         while dfa2 != student_pac.dfa:
             teacher_pac.teach(student_pac)
 
+    def test_incremental_hypothesis(self):
+        dfa_rand = random_dfa(["a", "b", "c", "d"], min_states=20, max_states=40, min_final=2, max_final=9)
+        teacher_exact = ExactTeacher(dfa_rand)
+        student_exact = DecisionTreeLearner(teacher_exact)
+        teacher_exact.teach(student_exact)
+        self.assertTrue(dfa_rand == student_exact.dfa)
+        # the hypothesis kept up to date split by split is the one built from scratch
+        incremental = student_exact.dfa
+        self.assertEqual(student_exact._produce_hypothesis().transitions, incremental.transitions)
+
+        # sifting the same words again is answered by the sift cache
+        def no_queries(word):
+            raise Exception("asked {}".format(word))
+        teacher_exact.membership_query = no_queries
+        self.assertEqual(student_exact._produce_hypothesis().transitions, incremental.transitions)
+
+    def test_binary_counterexample_analysis(self):
+        for _ in range(3):
+            dfa_rand = random_dfa(["a", "b", "c", "d"], min_states=20, max_states=40, min_final=2, max_final=9)
+            teacher_exact = ExactTeacher(dfa_rand)
+            student = DecisionTreeLearner(teacher_exact, counterexample_analysis="binary")
+            teacher_exact.teach(student)
+            self.assertTrue(dfa_rand == student.dfa)
+
+        # a long counterexample is analysed with a logarithmic number of queries. The target counts the letters mod 40
+        # with random steps (and "a" a step of 1), from every state its language needs 40 states, so a small hypothesis
+        # differs from it after any prefix.
+        steps = dict(zip(["a", "b", "c", "d"], [1] + np.random.randint(0, 40, size=3).tolist()))
+        counter = DFA(0, {0}, {s: {letter: (s + step) % 40 for letter, step in steps.items()} for s in range(40)})
+        teacher_exact = ExactTeacher(counter)
+        student = DecisionTreeLearner(teacher_exact, counterexample_analysis="binary")
+        student.new_counterexample(student.dfa.equivalence_with_counterexample(counter), max_refinements=1)
+        self.assertTrue(1 < len(student.dfa.states) < 40)
+        for _ in range(3):
+            prefix = tuple(np.random.choice(counter.alphabet, size=500))
+            hypothesis = student.dfa
+            state, hypothesis_state = counter.init_state, hypothesis.init_state
+            for letter in prefix:
+                state = counter.transitions[state][letter]
+                hypothesis_state = hypothesis.transitions[hypothesis_state][letter]
+            suffix = DFA(state, counter.final_states, counter.transitions).equivalence_with_counterexample(
+                DFA(hypothesis_state, hypothesis.final_states, hypothesis.transitions))
+            word = prefix + tuple(suffix)
+            self.assertTrue(counter.is_word_in(word) != hypothesis.is_word_in(word))
+
+            num_of_queries = teacher_exact.oracle.hits + teacher_exact.oracle.misses
+            student.new_counterexample(word, max_refinements=1)
+            self.assertTrue(teacher_exact.oracle.hits + teacher_exact.oracle.misses - num_of_queries < 50)
+
+    def test_batched_counterexample_processing(self):
+        for counterexample_analysis in ["linear", "binary"]:
+            dfa_rand = random_dfa(["a", "b", "c", "d"], min_states=20, max_states=40, min_final=2, max_final=9)
+            teacher_exact = ExactTeacher(dfa_rand)
+            student = DecisionTreeLearner(teacher_exact, counterexample_analysis=counterexample_analysis)
+
+            # with do_hypothesis_in_batches every query goes through is_words_in_batch
+            def no_single_queries(word):
+                raise Exception("asked {} alone".format(word))
+            teacher_exact.membership_query = no_single_queries
+            counter_example = student.dfa.equivalence_with_counterexample(dfa_rand)
+            while counter_example is not None:
+                student.new_counterexample(counter_example, do_hypothesis_in_batches=True)
+                counter_example = student.dfa.equivalence_with_counterexample(dfa_rand)
+            self.assertTrue(dfa_rand == student.dfa)
+
+    def test_discrimination_tree(self):
+        tree = DiscriminationTree(True)
+        leafs = [DiscriminationTree.ROOT]
+        for _ in range(300):
+            leaf = leafs.pop(np.random.randint(len(leafs)))
+            tree.left[leaf] = tree.add_node(leaf, tuple(), 0, False)
+            tree.right[leaf] = tree.add_node(leaf, tuple(), 0, True)
+            leafs.extend([tree.left[leaf], tree.right[leaf]])
+        self.assertTrue(all(tree.is_leaf(leaf) for leaf in leafs))
+
+        def ancestors(node):
+            path = [node]
+            while tree.parent[path[-1]] != -1:
+                path.append(tree.parent[path[-1]])
+            return path
+
+        for _ in range(200):
+            node1, node2 = np.random.randint(len(tree), size=2).tolist()
+            common = [node for node in ancestors(node1) if node in ancestors(node2)][0]
+            self.assertEqual(tree.common_ancestor(node1, node2), common)
+
+    def test_sift_set_deduplication(self):
+        dfa_rand = random_dfa(["a", "b", "c", "d"], min_states=20, max_states=40, min_final=2, max_final=9)
+        teacher_exact = ExactTeacher(dfa_rand)
+        student = DecisionTreeLearner(teacher_exact)
+        teacher_exact.teach(student)
+
+        asked = []
+        is_words_in_batch = dfa_rand.is_words_in_batch
+        dfa_rand.is_words_in_batch = lambda words: asked.extend(words) or is_words_in_batch(words)
+        words = [student._words.intern(word) for word in [("a", "b", "c"), ("d", "d"), ("a", "b", "c")] * 3]
+        states = [student._sift(word) for word in words]
+        asked.clear()
+        student._sift_cache = {}
+        # every query was answered by the sifts above
+        self.assertEqual(student._sift_set(words), states)
+        self.assertEqual(asked, [])
+
+        teacher_exact.oracle.clear()
+        student._sift_cache = {}
+        self.assertEqual(student._sift_set(words), [student._sift(word) for word in words])
+        self.assertTrue(len(asked) > 0)
+        self.assertEqual(len(asked), len(set(asked)))
+
+    def test_ttt_learner(self):
+        for _ in range(3):
+            dfa_rand = random_dfa(["a", "b", "c", "d"], min_states=20, max_states=40, min_final=2, max_final=9)
+            teacher_exact = ExactTeacher(dfa_rand)
+            student_exact = TTTLearner(teacher_exact)
+            teacher_exact.teach(student_exact)
+            self.assertTrue(dfa_rand == student_exact.dfa)
+
+        dfa2 = DFA(1, {1, 5}, {1: {"a": 2, "b": 5, "c": 5},
+                               2: {"a": 3, "b": 1, "c": 3},
+                               3: {"a": 4, "b": 4, "c": 4},
+                               4: {"a": 3, "b": 3, "c": 3},
+                               5: {"a": 2, "b": 1, "c": 1}})
+        teacher_pac = PACTeacher(dfa2)
+        student_pac = TTTLearner(teacher_pac)
+        while dfa2 != student_pac.dfa:
+            teacher_pac.teach(student_pac)
+
+        # the queries do not grow with the length of the counterexample
+        student = TTTLearner(ExactTeacher(dfa_rand))
+        while student.dfa != dfa_rand:
+            word = tuple(np.random.choice(dfa_rand.alphabet, size=300).tolist())
+            if dfa_rand.is_word_in(word) == student.dfa.is_word_in(word):
+                word = student.dfa.equivalence_with_counterexample(dfa_rand)
+            student.new_counterexample(word)
+        nodes = [student._root]
+        while len(nodes) != 0:
+            node = nodes.pop()
+            if node.final:
+                self.assertTrue(len(node.discriminator) < len(student.dfa.states))
+                nodes.extend(child for child in node.children.values() if not child.is_leaf)
+
+    def test_lsharp_learner(self):
+        for _ in range(3):
+            dfa_rand = random_dfa(["a", "b", "c", "d"], min_states=20, max_states=40, min_final=2, max_final=9)
+            teacher_exact = ExactTeacher(dfa_rand)
+            asked = []
+            membership_query = teacher_exact.membership_query
+            teacher_exact.membership_query = lambda word: asked.append(word) or membership_query(word)
+            student_exact = LSharpLearner(teacher_exact)
+            teacher_exact.teach(student_exact)
+            self.assertTrue(dfa_rand == student_exact.dfa)
+            # every word is asked only once
+            self.assertEqual(len(asked), len(set(asked)))
+
+        dfa2 = DFA(1, {1, 5}, {1: {"a": 2, "b": 5, "c": 5},
+                               2: {"a": 3, "b": 1, "c": 3},
+                               3: {"a": 4, "b": 4, "c": 4},
+                               4: {"a": 3, "b": 3, "c": 3},
+                               5: {"a": 2, "b": 1, "c": 1}})
+        teacher_pac = PACTeacher(dfa2)
+        student_pac = LSharpLearner(teacher_pac)
+        while dfa2 != student_pac.dfa:
+            teacher_pac.teach(student_pac)
+
+    def test_membership_oracle(self):
+        dfa_rand = random_dfa(["a", "b", "c", "d"], min_states=20, max_states=40, min_final=2, max_final=9)
+        teacher_exact = ExactTeacher(dfa_rand)
+        student = DecisionTreeLearner(teacher_exact)
+        teacher_exact.teach(student)
+
+        # a second learner of the same model gets every answer from the shared oracle
+        oracle = teacher_exact.oracle
+        self.assertTrue(PACTeacher(dfa_rand).oracle is oracle)
+        misses = oracle.misses
+        teacher_exact.teach(DecisionTreeLearner(teacher_exact))
+        self.assertEqual(oracle.misses, misses)
+
+        words = [tuple(np.random.choice(dfa_rand.alphabet, size=np.random.randint(10)).tolist()) for _ in range(100)]
+        self.assertEqual(oracle.is_words_in_batch(words).tolist(), dfa_rand.is_words_in_batch(words).tolist())
+
+        # the least recently used answers are dropped
+        small = MembershipOracle(dfa_rand, max_size=10)
+        for word in words:
+            self.assertEqual(small.is_word_in(word), dfa_rand.is_word_in(word))
+        self.assertTrue(len(small) <= 10)
+        self.assertTrue(words[-1] in small)
+
+        # the answers are kept on disk for a model that computes the same function
+        with tempfile.TemporaryDirectory() as folder:
+            saved = MembershipOracle(dfa_rand, cache_dir=folder)
+            saved.is_words_in_batch(words)
+            saved.save()
+            loaded = MembershipOracle(dfa_rand.minimize(), cache_dir=folder)
+            self.assertEqual(loaded.is_words_in_batch(words).tolist(), saved.is_words_in_batch(words).tolist())
+            self.assertEqual(loaded.misses, 0)
+            self.assertEqual(len(MembershipOracle(random_dfa(["a", "b", "c", "d"]), cache_dir=folder)), 0)
+
+    def test_prefix_trie_batch(self):
+        rnn = _small_rnn()
+
+        words = [tuple(np.random.choice(rnn.alphabet, size=np.random.randint(0, 15)).tolist()) for _ in range(200)]
+        words += [word[:len(word) // 2] for word in words] + [tuple()]
+        levels, terminals = prefix_trie_levels([[rnn._char_to_int[l] for l in word] or [0] for word in words])
+        # every distinct prefix is a single node
+        self.assertEqual(sum(len(parents) for parents, _ in levels),
+                         len({word[:i] for word in words for i in range(1, len(word) + 1)}) + 1)
+        self.assertEqual(len(terminals), len(words))
+
+        padded = rnn.is_words_in_batch(words, share_prefixes=False).detach().numpy()
+        shared = rnn.is_words_in_batch(words).numpy()
+        self.assertTrue(np.allclose(padded, shared, atol=1e-6))
+
+    def test_length_batches(self):
+        lengths = np.random.geometric(0.05, size=1000) - 1
+        batches = length_batches(lengths, 500)
+        self.assertEqual(sorted(np.concatenate(batches).tolist()), list(range(1000)))
+        for batch in batches:
+            self.assertTrue(len(batch) == 1 or len(batch) * max(lengths[batch].max(), 1) <= 500)
+
+        rnn = _small_rnn()
+        letters, offsets = random_words_csr(300, rnn.alphabet, p=0.05)
+        words = words_from_csr(letters, offsets, rnn.alphabet)
+        # the outputs come back in the order of the words
+        expected = rnn.is_words_in_batch(words, share_prefixes=False).detach().numpy()
+        self.assertTrue(np.allclose(rnn.is_words_in_batches(words, max_tokens=200).numpy(), expected, atol=1e-6))
+        self.assertTrue(np.allclose(rnn.is_words_in_batches(letters, offsets=offsets, max_tokens=200).numpy(),
+                                    expected, atol=1e-6))
+
+    def test_inference_path(self):
+        rnn = _small_rnn()
+
+        letters, offsets = random_words_csr(200, rnn.alphabet, p=0.1)
+        words = words_from_csr(letters, offsets, rnn.alphabet)
+        encoded = [torch.tensor([rnn._char_to_int[l] for l in word] or [0]) for word in words]
+        lengths = torch.tensor([len(word) for word in encoded])
+        expected, _ = rnn._rnn(pad_sequence(encoded, batch_first=True), lengths, rnn._rnn.init_hidden(len(words)))
+
+        for outputs in [rnn.is_words_in_batch(words, share_prefixes=False), rnn.is_words_in_batch(letters, offsets)]:
+            self.assertFalse(outputs.requires_grad)
+            self.assertTrue(np.allclose(outputs.numpy(), expected.detach().numpy(), atol=1e-6))
+        self.assertEqual([rnn.is_word_in(word) for word in words[:20]], (expected[:20] > 0.5).tolist())
+
+    def test_quantized(self):
+        rnn = _small_rnn()
+        quantized = rnn.quantize()
+        self.assertTrue(quantized.quantized and not rnn.quantized)
+        self.assertNotEqual(model_hash(quantized), model_hash(rnn))
+
+        letters, offsets = random_words_csr(200, rnn.alphabet, p=0.1)
+        words = words_from_csr(letters, offsets, rnn.alphabet)
+        expected = rnn.is_words_in_batch(words).numpy()
+        for outputs in [quantized.is_words_in_batch(words), quantized.is_words_in_batch(words, share_prefixes=False),
+                        quantized.is_words_in_batch(letters, offsets)]:
+            self.assertTrue(np.allclose(outputs.numpy(), expected, atol=0.05))
+
+        report = quantization_agreement(rnn, quantized, width=0.05, word_prob=0.1, chunk_size=500, seed=0)
+        self.assertEqual(report.num_of_samples, int(np.log(2 / 0.001) / (2 * 0.05 * 0.05)))
+        self.assertEqual(report.disagreement_rate, report.disagreements / report.num_of_samples)
+        self.assertAlmostEqual(report.upper_bound, report.disagreement_rate + 0.05)
+
+    def test_pac_teacher_seed(self):
+        rnn = _small_rnn()
+        # the network accepts every word, so the first word drawn is a counterexample for the empty language
+        rnn._rnn.fc.bias.data.fill_(10)
+        empty = DFA(0, [], {0: {letter: 0 for letter in rnn.alphabet}})
+        first_word = words_from_csr(*random_words_csr(200, rnn.alphabet, seed=3), rnn.alphabet)[0]
+        self.assertTrue(rnn.is_word_in(first_word))
+        self.assertEqual(PACTeacher(rnn, seed=3).equivalence_query(empty), first_word)
+        self.assertEqual(PACTeacher(rnn, seed=3).model_subset_of_dfa_query(empty), first_word)
+        self.assertTrue(PACTeacher(rnn, seed=3).model_subset_of_dfa_query(DFA(0, [0], empty.transitions)) is None)
+
+    def test_hidden_state_cache(self):
+        rnn = _small_rnn(hidden_cache_size=20)
+
+        word = tuple(np.random.choice(rnn.alphabet, size=50).tolist())
+        prefixes = [word[:i] for i in range(1, len(word) + 1)]
+        expected = rnn.is_words_in_batch(prefixes, share_prefixes=False).detach().numpy()
+        # every prefix is run on from the state of the one before
+        for prefix in prefixes:
+            rnn.is_word_in(prefix)
+        self.assertTrue(np.allclose([rnn._hidden_state(prefix)[1].item() for prefix in prefixes[-20:]],
+                                    expected[-20:], atol=1e-6))
+        info = rnn.hidden_cache_info()
+        self.assertEqual((info.hits, info.prefix_hits, info.misses, info.size), (20, 49, 1, 20))
+        # a longer word is run on from its longest cached prefix
+        rnn.is_word_in(word + ("a",) * 10)
+        self.assertEqual(rnn.hidden_cache_info().prefix_hits, 50)
+        self.assertEqual(prefix_hashes([1, 3, 2]),
+                         [0, 1, PREFIX_HASH_BASE + 3, (PREFIX_HASH_BASE + 3) * PREFIX_HASH_BASE + 2])
+
     def test_check_and_teach(self):
         dfa1 = DFA(1, {1}, {1: {"a": 2, "b": 1, "c": 1},
                             2: {"a": 3, "b": 1, "c": 3},
@@ -0,0 +1,95 @@
+class WordTrie:
+    """
+    Words interned as the nodes of a prefix trie, each identified by an integer id (EMPTY for the empty word).
+    Extending a word by a letter is a single dictionary lookup and the ids hash as integers, the tuple of a word is
+    only built by word() when it has to be handed to a model.
+    A concatenation gets an id of its own that keeps its two parts, it is only added to the trie letter by letter
+    if it is extended. So the same word can have a concatenation id besides its trie id.
+    The tuples built are kept, except for those of concatenations (the queries, built once), so building the tuple
+    of a word walks the trie only up to the closest prefix built before.
+    """
+
+    EMPTY = 0
+
+    def __init__(self):
+        self._parents = [-1]
+        self._letters = [None]
+        self._lengths = [0]
+        self._children = {}
+        self._concatenations = {}
+        self._concatenation_parts = {}
+        self._words = {WordTrie.EMPTY: tuple()}
+
+    def __len__(self):
+        return len(self._parents)
+
+    def extend(self, word_id, letter):
+        if word_id in self._concatenation_parts:
+            word_id = self._to_trie(word_id)
+        key = (word_id, letter)
+        child = self._children.get(key)
+        if child is None:
+            child = len(self._parents)
+            self._parents.append(word_id)
+            self._letters.append(letter)
+            self._lengths.append(self._lengths[word_id] + 1)
+            self._children[key] = child
+        return child
+
+    def extend_by(self, word_id, letters):
+        for letter in letters:
+            word_id = self.extend(word_id, letter)
+        return word_id
+
+    def intern(self, word):
+        return self.extend_by(WordTrie.EMPTY, word)
+
+    def concat(self, word_id, suffix_id):
+        """
+        The id of the word of word_id followed by the word of suffix_id, the same one for the same two ids.
+        """
+        if suffix_id == WordTrie.EMPTY:
+            return word_id
+        if word_id == WordTrie.EMPTY:
+            return suffix_id
+        key = (word_id, suffix_id)
+        concatenation = self._concatenations.get(key)
+        if concatenation is None:
+            concatenation = len(self._parents)
+            self._parents.append(-1)
+            self._letters.append(None)
+            self._lengths.append(self._lengths[word_id] + self._lengths[suffix_id])
+            self._concatenations[key] = concatenation
+            self._concatenation_parts[concatenation] = key
+        return concatenation
+
+    def _to_trie(self, concatenation):
+        word_id, suffix_id = self._concatenation_parts[concatenation]
+        return self.extend_by(word_id, self.word(suffix_id))
+
+    def length(self, word_id):
+        return self._lengths[word_id]
+
+    def word(self, word_id, keep=False):
+        """
+        The tuple of the word of word_id, kept if keep is set even if it is a concatenation.
+        """
+        word = self._words.get(word_id)
+        if word is not None:
+            return word
+
+        parts = self._concatenation_parts.get(word_id)
+        if parts is not None:
+            word = self.word(parts[0]) + self.word(parts[1])
+            if keep:
+                self._words[word_id] = word
+            return word
+
+        letters = []
+        prefix_id = word_id
+        while prefix_id not in self._words:
+            letters.append(self._letters[prefix_id])
+            prefix_id = self._parents[prefix_id]
+        word = self._words[prefix_id] + tuple(reversed(letters))
+        self._words[word_id] = word
+        return word